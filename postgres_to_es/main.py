@@ -1,14 +1,24 @@
+import argparse
 import logging
+import multiprocessing
 import os
+import queue
 import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
+import psycopg2
 from dotenv import load_dotenv
 
-from services.es_loader import ESLoader
+from services.async_es_loader import AsyncESLoader
+from services.change_listener import ChangeListener
+from services.es_loader import BulkLoadError, ESLoader
+from services.hash_cache import DocumentHashCache
+from services.ndjson_es_loader import NDJSONESLoader
 from services.pg_extractor import PostgresExtractor
-from state.state import state
+from services.pipeline import ETLPipeline
+from services.planner import ChangeSetPlanner
+from state.state import State, create_storage, state
 from utils.schemas import PGObject
 
 load_dotenv(dotenv_path='../etl/.env')
@@ -24,6 +34,62 @@ BLOCK_SIZE = 1000
 
 PAUSE_DURATION = 60
 
+# Max duration of one ETL cycle draining pending changes in seconds
+CYCLE_TIME_BUDGET = int(os.environ.get('ETL_CYCLE_TIME_BUDGET', 300))
+
+SERVER_SIDE_CURSORS = (
+    os.environ.get('PG_SERVER_SIDE_CURSORS', 'true').lower() == 'true'
+)
+
+# Max number of pooled Postgres connections shared by ETL stages
+PG_POOL_MAX = int(os.environ.get('PG_POOL_MAX', 4))
+
+# Seconds to wait for a free pooled connection before failing
+PG_POOL_TIMEOUT = float(os.environ.get('PG_POOL_TIMEOUT', 30))
+
+# Read each ETL page in one read-only REPEATABLE READ snapshot
+SNAPSHOT_ISOLATION = (
+    os.environ.get('PG_SNAPSHOT_ISOLATION', 'false').lower() == 'true'
+)
+
+# Changes younger than the lag are loaded next cycle, so rows committed
+# late with an earlier modified_at are not skipped by the checkpoint
+MODIFIED_LAG_SECONDS = int(os.environ.get('ETL_MODIFIED_LAG_SECONDS', 0))
+
+# poll or notify
+CHANGE_DETECTION = os.environ.get('ETL_CHANGE_DETECTION', 'poll')
+
+NOTIFY_COALESCE_WINDOW = float(
+    os.environ.get('ETL_NOTIFY_COALESCE_WINDOW', 0.5)
+)
+
+# Interval of modified_at scans used as a fallback in notify mode
+FALLBACK_SCAN_INTERVAL = int(os.environ.get('ETL_FALLBACK_SCAN_INTERVAL', 600))
+
+STATE_STORAGE = os.environ.get('STATE_STORAGE', 'json')
+
+SQL_DOCUMENTS = os.environ.get('PG_SQL_DOCUMENTS', 'false').lower() == 'true'
+
+FAST_TRANSFORM = (
+    os.environ.get('ETL_FAST_TRANSFORM', 'false').lower() == 'true'
+)
+
+# Apply person and genre changes as partial updates of ES documents
+PARTIAL_UPDATES = (
+    os.environ.get('ETL_PARTIAL_UPDATES', 'false').lower() == 'true'
+)
+
+# Worker processes of full reindex, each loads its own range of ids
+REINDEX_WORKERS = int(
+    os.environ.get('ETL_REINDEX_WORKERS', os.cpu_count() or 1)
+)
+
+REINDEX_MAX_RESTARTS = int(os.environ.get('ETL_REINDEX_MAX_RESTARTS', 3))
+
+PIPELINE_ENABLED = os.environ.get('ETL_PIPELINE', 'false').lower() == 'true'
+
+PIPELINE_QUEUE_SIZE = int(os.environ.get('ETL_PIPELINE_QUEUE_SIZE', 2))
+
 DSN = {
     'dbname': os.environ.get('POSTGRES_DB'),
     'user': os.environ.get('POSTGRES_USER'),
@@ -39,14 +105,62 @@ ES_PARAMS = [{
     'port': int(os.environ.get('ES_PORT')),
 }]
 
+ES_INDEX_NAME = os.environ.get('ES_INDEX_NAME')
+
+# Comma separated indexes loaded together with the main one
+ES_SHADOW_INDEXES = [
+    index_name
+    for index_name in os.environ.get('ES_SHADOW_INDEXES', '').split(',')
+    if index_name
+]
+
+# Empty path disables skipping of unchanged documents
+ES_HASH_CACHE_PATH = os.environ.get('ES_HASH_CACHE_PATH', '')
+
+ES_HASH_CACHE_MAX_ENTRIES = int(
+    os.environ.get('ES_HASH_CACHE_MAX_ENTRIES', 1_000_000)
+)
+
+ES_LOADER = os.environ.get('ES_LOADER', 'sync')
+
+ES_BULK_CONCURRENCY = int(os.environ.get('ES_BULK_CONCURRENCY', 4))
+
+ES_BULK_CHUNK_SIZE = int(os.environ.get('ES_BULK_CHUNK_SIZE', 250))
+
+ES_BULK_MAX_BYTES = int(os.environ.get('ES_BULK_MAX_BYTES', 10 * 1024 * 1024))
+
+ES_BULK_MAX_RETRIES = int(os.environ.get('ES_BULK_MAX_RETRIES', 5))
+
+ES_DEAD_LETTER_PATH = os.environ.get(
+    'ES_DEAD_LETTER_PATH',
+    'dead_letter.ndjson',
+)
+
 
 class ETL:
 
-    def __init__(self, pg_extractor: PostgresExtractor, es_loader: ESLoader):
+    def __init__(
+        self,
+        pg_extractor: PostgresExtractor,
+        es_loader: ESLoader,
+        pipeline_enabled: bool = False,
+        partial_updates: bool = False,
+    ):
         """Initialize ETL class."""
 
         self.pg_extractor = pg_extractor
         self.es_loader = es_loader
+        self.pipeline_enabled = pipeline_enabled
+        self.partial_updates = partial_updates
+        self.pipeline = None
+
+    def close(self) -> None:
+        """Close Postgres connections and ElasticSearch clients."""
+
+        try:
+            self.pg_extractor.close()
+        finally:
+            self.es_loader.close()
 
     def schemas_to_ids(self, objects: list) -> list:
         """Extract id of each object in list and return list of ids."""
@@ -69,22 +183,95 @@ class ETL:
             'last_person_id',
         ]
 
-        for modified in last_modified:
-            if not state.get_state(modified):
-                state.set_state(modified, str(datetime(2000, 1, 1)))
+        with state.transaction():
+            for modified in last_modified:
+                if not state.get_state(modified):
+                    state.set_state(modified, str(datetime(2000, 1, 1)))
+
+            for id in last_processed_ids:
+                if not state.get_state(id):
+                    state.set_state(id, str(uuid.uuid4()))
+
+    def apply_reindex_rewind(self) -> None:
+        """Reload changes made during a finished full reindex.
+
+        The modified_at lag is subtracted, as rows may be committed
+        later than their modified_at.
+        """
+
+        rewind = state.get_state('reindex_rewind')
+        if not rewind:
+            return
+
+        last_modified = str(
+            datetime.fromisoformat(rewind)
+            - timedelta(seconds=MODIFIED_LAG_SECONDS)
+        )
+        with state.transaction():
+            for name in ('person', 'genre', 'filmwork'):
+                state.set_state(f'last_modified_{name}', last_modified)
+                state.set_state(f'last_{name}_id', str(uuid.UUID(int=0)))
+            state.set_state('reindex_rewind', None)
 
-        for id in last_processed_ids:
-            if not state.get_state(id):
-                state.set_state(id, str(uuid.uuid4()))
+        logging.info('ETL checkpoints rewound to %s.', last_modified)
 
     def run(self) -> None:
-        """Main ETL proccess function."""
+        """Main ETL proccess function.
+
+        Pages of modified objects are processed until all pending changes
+        are loaded or the cycle time budget is exhausted.
+        """
 
         logging.info('ETL proccess started.')
 
+        state.refresh()
         self.check_state()
+        self.apply_reindex_rewind()
         self.es_loader.create_index()
-        pg_connection = self.pg_extractor._open_connection()
+        deadline = time.monotonic() + CYCLE_TIME_BUDGET
+
+        try:
+            with self.pg_extractor.connection() as pg_connection:
+                while not self.run_page(pg_connection):
+                    if time.monotonic() >= deadline:
+                        logging.info('ETL cycle time budget is exhausted.')
+                        break
+        except (
+            BulkLoadError,
+            psycopg2.OperationalError,
+            psycopg2.InterfaceError,
+        ) as exc:
+            # State is not advanced, the page is processed again next cycle
+            # and broken connections are replaced by the pool
+            logging.error('ETL cycle stopped: %s', exc)
+
+        logging.info('ETL proccess stopped.')
+
+    def run_page(self, pg_connection) -> bool:
+        """Process one page of modified persons, genres and filmworks.
+
+        Queries of the page see one snapshot of the database when snapshot
+        isolation is enabled. Return True if there were no changes left.
+        """
+
+        with self.pg_extractor.snapshot(pg_connection) as snapshot_id:
+            checkpoint = self.plan_and_load_page(pg_connection, snapshot_id)
+
+        caught_up = all(
+            state.get_state(key) == value for key, value in checkpoint.items()
+        )
+        with state.transaction():
+            for key, value in checkpoint.items():
+                state.set_state(key, value)
+
+        return caught_up
+
+    def plan_and_load_page(
+        self, pg_connection, snapshot_id: str | None
+    ) -> dict:
+        """Load one page of changes and return checkpoint of the page."""
+
+        planner = ChangeSetPlanner(self.pg_extractor.block_size)
 
         # last modified states
         last_modified_person = state.get_state('last_modified_person')
@@ -96,51 +283,387 @@ class ETL:
         last_genre_id = state.get_state('last_genre_id')
         last_filmwork_id = state.get_state('last_filmwork_id')
 
-        # Run etl proccess with modified persons
+        # Plan filmworks affected by modified persons
         last_person = self.filmworks_by_modified_persons(
             last_modified_person,
             last_person_id,
             pg_connection,
+            planner,
         )
-        
-        # Run etl proccess with modified genres
+
+        # Plan filmworks affected by modified genres
         last_genre = self.filmworks_by_modified_genres(
             last_modified_genre,
             last_genre_id,
             pg_connection,
+            planner,
         )
 
-        # Run etl proccess with modified filmworks
+        # Plan modified filmworks
         last_filmwork = self.modified_filmworks(
             last_modified_filmwork,
             last_filmwork_id,
             pg_connection,
+            planner,
         )
 
-        # # Rewrite last modified states
-        last_ids = {
-            'last_person_id': last_person.id,
-            'last_genre_id': last_genre.id,
-            'last_filmwork_id': last_filmwork.id,
-        }
-        for key, value in last_ids.items():
-            state.set_state(key, str(value))
-
-        # Rewrite last proccessed id states
-        last_modified = {
-            'last_modified_person': last_person.modified_at,
-            'last_modified_genre': last_genre.modified_at,
-            'last_modified_filmwork': last_filmwork.modified_at,
+        self.load_planned(planner, pg_connection, snapshot_id)
+
+        # Last proccessed id and last modified states are rewritten at once
+        return {
+            'last_person_id': str(last_person.id),
+            'last_genre_id': str(last_genre.id),
+            'last_filmwork_id': str(last_filmwork.id),
+            'last_modified_person': str(last_person.modified_at),
+            'last_modified_genre': str(last_genre.modified_at),
+            'last_modified_filmwork': str(last_filmwork.modified_at),
         }
-        for key, value in last_modified.items():
-            state.set_state(key, str(value))
 
-        self.pg_extractor._close_connection()
+    def reindex(self, workers: int = 1) -> None:
+        """Rebuild the whole index in a new index and swap the alias.
+
+        Filmworks are split into id ranges loaded by worker processes.
+        Each partition keeps its own checkpoint, so an interrupted reindex
+        is resumed into the same index and finished partitions are skipped.
+        The incremental ETL may keep running, it writes to the old index
+        meanwhile. After the swap it rewinds its checkpoints to the start
+        of the reindex, so changes made during the rebuild are loaded into
+        the new index too.
+        """
+
+        logging.info('ETL full reindex started.')
+
+        state.refresh()
+        index_name = state.get_state('reindex_index')
+        if index_name:
+            # Partition bounds must not change while resuming
+            workers = state.get_state('reindex_workers')
+            logging.info('Resuming reindex into %s index.', index_name)
+        else:
+            with self.pg_extractor.connection() as connection:
+                started_at = self.pg_extractor.get_current_time(connection)
+            index_name = self.es_loader.create_reindex_index()
+            with state.transaction():
+                state.set_state('reindex_index', index_name)
+                state.set_state('reindex_workers', workers)
+                state.set_state('reindex_started_at', str(started_at))
+
+        # Workers read filmworks in the snapshot of this transaction
+        with (
+            self.pg_extractor.connection() as connection,
+            self.pg_extractor.snapshot(connection) as snapshot_id,
+        ):
+            self.run_reindex_workers(workers, index_name, snapshot_id)
+
+        self.es_loader.finish_reindex(index_name)
+        with state.transaction():
+            # Picked up by the incremental ETL on its next cycle
+            state.set_state(
+                'reindex_rewind',
+                state.get_state('reindex_started_at'),
+            )
+            state.set_state('reindex_index', None)
+            state.set_state('reindex_workers', None)
+            state.set_state('reindex_started_at', None)
+
+        logging.info('ETL full reindex finished.')
+
+    def run_reindex_workers(
+        self,
+        workers: int,
+        index_name: str,
+        snapshot_id: str | None,
+    ) -> None:
+        """Run partition workers, restart failed ones and log progress."""
+
+        context = multiprocessing.get_context('spawn')
+        progress = context.Queue()
+        processes = {}
+        restarts = dict.fromkeys(range(workers), 0)
+        loaded = dict.fromkeys(range(workers), 0)
+
+        def start(partition: int) -> None:
+            process = context.Process(
+                target=reindex_worker,
+                args=(partition, workers, index_name, snapshot_id, progress),
+                name=f'reindex-{partition}',
+            )
+            process.start()
+            processes[partition] = process
+
+        for partition in range(workers):
+            start(partition)
+
+        while processes:
+            try:
+                partition, count = progress.get(timeout=1)
+                loaded[partition] += count
+                logging.info(
+                    'Reindexed %s filmworks, partition %s: %s.',
+                    sum(loaded.values()),
+                    partition,
+                    loaded[partition],
+                )
+            except queue.Empty:
+                pass
+
+            for partition, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del processes[partition]
+                if process.exitcode == 0:
+                    continue
+
+                if restarts[partition] >= REINDEX_MAX_RESTARTS:
+                    for other in processes.values():
+                        other.terminate()
+                    raise RuntimeError(
+                        f'Reindex partition {partition} failed, '
+                        f'run reindex again to resume it.'
+                    )
+
+                # Partition resumes from its own checkpoint
+                restarts[partition] += 1
+                logging.warning(
+                    'Reindex partition %s exited with %s, restarting.',
+                    partition,
+                    process.exitcode,
+                )
+                start(partition)
+
+    def reindex_partition(
+        self,
+        partition: int,
+        workers: int,
+        index_name: str,
+        snapshot_id: str | None,
+        progress,
+    ) -> None:
+        """Load filmworks of one id range into the reindex index."""
+
+        partition_state = State(
+            create_storage(STATE_STORAGE, DSN, f'reindex_{partition}')
+        )
+        if partition_state.get_state('index') != index_name:
+            with partition_state.transaction():
+                partition_state.set_state('index', index_name)
+                partition_state.set_state('last_id', None)
+                partition_state.set_state('done', False)
+        if partition_state.get_state('done'):
+            return
+
+        start_id, end_id = partition_bounds(partition, workers)
+        last_id = partition_state.get_state('last_id') or str(start_id)
+
+        self.es_loader.write_indexes = [index_name]
+
+        with (
+            self.pg_extractor.connection() as pg_connection,
+            self.pg_extractor.snapshot(pg_connection, snapshot_id),
+        ):
+            while filmworks := self.pg_extractor.extract_filmworks_in_range(
+                last_id,
+                end_id,
+                pg_connection,
+            ):
+                self.load_filmworks(
+                    self.schemas_to_ids(filmworks),
+                    pg_connection,
+                )
+                last_id = str(filmworks[-1].id)
+                partition_state.set_state('last_id', last_id)
+                progress.put((partition, len(filmworks)))
+
+        partition_state.set_state('done', True)
+
+    def process_changes(self, changes: dict) -> None:
+        """Reindex filmworks affected by changes received from listener."""
+
+        logging.info('ETL proccess started for notified changes.')
+
+        planner = ChangeSetPlanner(self.pg_extractor.block_size)
+
+        try:
+            with (
+                self.pg_extractor.connection() as connection,
+                self.pg_extractor.snapshot(connection) as snapshot_id,
+            ):
+                if changes['person']:
+                    self.plan_person_filmworks(
+                        list(changes['person']),
+                        connection,
+                        planner,
+                    )
+
+                if changes['genre']:
+                    self.plan_genre_filmworks(
+                        list(changes['genre']),
+                        connection,
+                        planner,
+                    )
+
+                planner.add(list(changes['filmwork']))
+
+                self.load_planned(planner, connection, snapshot_id)
+        except BulkLoadError as exc:
+            # Changes are picked up again by the fallback modified_at scan
+            logging.error('ETL proccess of notified changes stopped: %s', exc)
 
         logging.info('ETL proccess stopped.')
-    
+
+    def start_pipeline(self, snapshot_id: str | None = None) -> None:
+        """Start pipeline workers if pipeline mode is enabled."""
+
+        if self.pipeline_enabled:
+            self.pipeline = ETLPipeline(
+                self.pg_extractor,
+                self.es_loader,
+                PIPELINE_QUEUE_SIZE,
+                snapshot_id,
+            )
+            self.pipeline.start()
+
+    def join_pipeline(self) -> None:
+        """Wait for the pipeline to load every submitted block."""
+
+        if self.pipeline:
+            pipeline, self.pipeline = self.pipeline, None
+            pipeline.join()
+
+    def stop_pipeline(self) -> None:
+        """Stop pipeline workers without raising their errors."""
+
+        if self.pipeline:
+            pipeline, self.pipeline = self.pipeline, None
+            pipeline.stop()
+
+    def load_planned(
+        self,
+        planner: ChangeSetPlanner,
+        connection,
+        snapshot_id: str | None = None,
+    ) -> None:
+        """Enrich and load each planned filmwork exactly once."""
+
+        self.start_pipeline(snapshot_id)
+        try:
+            for fw_ids in planner.blocks():
+                self.load_filmworks(fw_ids, connection)
+        except BaseException:
+            # Stage threads must not outlive the failed cycle
+            self.stop_pipeline()
+            raise
+        self.join_pipeline()
+
+    def load_filmworks(self, fw_ids: list, connection) -> None:
+        """Enrich filmworks by ids and load them into ElasticSearch.
+
+        In pipeline mode the block is only submitted to the pipeline and
+        is loaded by its workers.
+        """
+
+        if self.pipeline:
+            self.pipeline.submit(fw_ids)
+            return
+
+        filmworks = self.pg_extractor.extract_filmwork_data(
+            fw_ids,
+            connection,
+        )
+        if not self.es_loader.insert_bulk_data(filmworks):
+            raise BulkLoadError('Could not load filmworks block to ES.')
+
+    def plan_person_filmworks(
+        self, person_ids: list, connection, planner: ChangeSetPlanner
+    ) -> None:
+        """Plan reindex of filmworks related to modified persons."""
+
+        if self.partial_updates:
+            person_ids = self.rename_persons(person_ids, connection, planner)
+            if not person_ids:
+                return
+
+        filmworks = self.pg_extractor.extract_filmworks_by_modified_persons(
+            person_ids,
+            connection,
+        )
+        for fw_block in filmworks:
+            planner.add(self.schemas_to_ids(fw_block))
+
+    def plan_genre_filmworks(
+        self, genre_ids: list, connection, planner: ChangeSetPlanner
+    ) -> None:
+        """Plan reindex of filmworks related to modified genres.
+
+        With partial updates only genre names of the filmworks are updated.
+        """
+
+        filmworks = self.pg_extractor.extract_filmworks_by_modified_genres(
+            genre_ids,
+            connection,
+        )
+        for fw_block in filmworks:
+            fw_ids = self.schemas_to_ids(fw_block)
+            if not self.partial_updates:
+                planner.add(fw_ids)
+                continue
+
+            genres = self.pg_extractor.extract_filmwork_genres(
+                fw_ids,
+                connection,
+            )
+            if not self.es_loader.update_filmwork_genres(genres):
+                raise BulkLoadError('Could not update filmwork genres in ES.')
+
+    def rename_persons(
+        self, person_ids: list, connection, planner: ChangeSetPlanner
+    ) -> list:
+        """Apply person name changes as partial updates of filmworks.
+
+        Return ids of persons that need full reindex of their filmworks:
+        directors, who are indexed by name only, and persons whose links
+        to filmworks differ from the indexed ones.
+        """
+
+        persons = self.pg_extractor.extract_person_links(
+            person_ids,
+            connection,
+        )
+        indexed = self.es_loader.find_person_filmworks(person_ids)
+
+        names = {}
+        fw_ids = set()
+        full_reindex = []
+        for person_id in person_ids:
+            person = persons.get(person_id, {'full_name': '', 'links': set()})
+            links = person['links']
+            indexed_links = indexed.get(person_id, set())
+
+            if (
+                links != indexed_links or
+                any(role == 'director' for _, role in links)
+            ):
+                full_reindex.append(person_id)
+                # Filmworks the person was removed from
+                planner.add([fw_id for fw_id, _ in indexed_links - links])
+            elif links:
+                names[person_id] = person['full_name']
+                fw_ids.update(fw_id for fw_id, _ in links)
+
+        if names:
+            if not self.es_loader.update_person_names(names, list(fw_ids)):
+                raise BulkLoadError('Could not update person names in ES.')
+            logging.info('Renamed %s persons in ES index.', len(names))
+
+        return full_reindex
+
     def filmworks_by_modified_persons(
-        self, last_modified: datetime, last_id: str, connection
+        self,
+        last_modified: datetime,
+        last_id: str,
+        connection,
+        planner: ChangeSetPlanner,
     ) -> PGObject:
         persons = self.pg_extractor.extract_modified_persons(
             last_modified,
@@ -151,26 +674,18 @@ class ETL:
         if persons:
             last_person = persons[-1]
             person_ids = self.schemas_to_ids(persons)
-            filmworks = (
-                self.pg_extractor.extract_filmworks_by_modified_persons(
-                    person_ids,
-                    connection,
-                )
-            )
-            for fw_block in filmworks:
-                fw_ids = self.schemas_to_ids(fw_block)
-                filmworks = self.pg_extractor.extract_filmwork_data(
-                    fw_ids,
-                    connection,
-                )
-                self.es_loader.insert_bulk_data(filmworks)
+            self.plan_person_filmworks(person_ids, connection, planner)
 
             return last_person
 
         return PGObject(id=uuid.UUID(last_id), modified_at=last_modified)
 
     def filmworks_by_modified_genres(
-        self, last_modified: datetime, last_id: str, connection
+        self,
+        last_modified: datetime,
+        last_id: str,
+        connection,
+        planner: ChangeSetPlanner,
     ) -> PGObject:
         genres = self.pg_extractor.extract_modified_genres(
             last_modified,
@@ -181,26 +696,18 @@ class ETL:
         if genres:
             last_genre = genres[-1]
             genre_ids = self.schemas_to_ids(genres)
-            filmworks = (
-                self.pg_extractor.extract_filmworks_by_modified_genres(
-                    genre_ids,
-                    connection,
-                )
-            )
-            for fw_block in filmworks:
-                fw_ids = self.schemas_to_ids(fw_block)
-                filmworks = self.pg_extractor.extract_filmwork_data(
-                    fw_ids,
-                    connection,
-                )
-                self.es_loader.insert_bulk_data(filmworks)
+            self.plan_genre_filmworks(genre_ids, connection, planner)
 
             return last_genre
 
         return PGObject(id=uuid.UUID(last_id), modified_at=last_modified)
     
     def modified_filmworks(
-        self, last_modified: datetime, last_id: str, connection
+        self,
+        last_modified: datetime,
+        last_id: str,
+        connection,
+        planner: ChangeSetPlanner,
     ) -> PGObject:
         
         filmworks = self.pg_extractor.extract_modified_filmworks(
@@ -211,28 +718,227 @@ class ETL:
 
         if filmworks:
             last_filmwork = filmworks[-1]
-            fw_ids = self.schemas_to_ids(filmworks)
-            filmworks = self.pg_extractor.extract_filmwork_data(
-                fw_ids,
-                connection,
-            )
-            self.es_loader.insert_bulk_data(filmworks)
+            planner.add(self.schemas_to_ids(filmworks))
 
             return last_filmwork
 
         return PGObject(id=uuid.UUID(last_id), modified_at=last_modified)
 
 
-def main():
-    pg_extractor = PostgresExtractor(DSN, BLOCK_SIZE)
-    es_loader = ESLoader(ES_PARAMS, os.environ.get('ES_INDEX_NAME'))
+def partition_bounds(partition: int, workers: int) -> tuple:
+    """Return (exclusive start, inclusive end) ids of a partition.
+
+    The UUID space is split into equal ranges, random UUIDs spread
+    evenly between them.
+    """
+
+    step = 2 ** 128 // workers
+    start_id = uuid.UUID(int=partition * step)
+    if partition == workers - 1:
+        end_id = uuid.UUID(int=2 ** 128 - 1)
+    else:
+        end_id = uuid.UUID(int=(partition + 1) * step)
+    return start_id, end_id
+
+
+def reindex_worker(
+    partition: int,
+    workers: int,
+    index_name: str,
+    snapshot_id: str | None,
+    progress,
+) -> None:
+    """Reindex one partition in a worker process with own connections.
+
+    Hash cache is not used, as hashes are kept by index names and the new
+    index is cached only after the alias swap.
+    """
+
+    # One connection is enough for a worker loading blocks sequentially
+    etl = ETL(create_pg_extractor(pool_max=1), create_es_loader(False))
+    try:
+        etl.reindex_partition(
+            partition,
+            workers,
+            index_name,
+            snapshot_id,
+            progress,
+        )
+    finally:
+        etl.close()
+
+
+def create_pg_extractor(pool_max: int = PG_POOL_MAX) -> PostgresExtractor:
+    """Create Postgres extractor configured by environment settings."""
+
+    return PostgresExtractor(
+        DSN,
+        BLOCK_SIZE,
+        SERVER_SIDE_CURSORS,
+        SQL_DOCUMENTS,
+        FAST_TRANSFORM,
+        pool_max,
+        SNAPSHOT_ISOLATION,
+        MODIFIED_LAG_SECONDS,
+        PG_POOL_TIMEOUT,
+    )
+
+
+def create_hash_cache() -> DocumentHashCache | None:
+    """Create document hash cache if ES_HASH_CACHE_PATH is set."""
+
+    if not ES_HASH_CACHE_PATH:
+        return None
+
+    return DocumentHashCache(ES_HASH_CACHE_PATH, ES_HASH_CACHE_MAX_ENTRIES)
+
+
+def create_es_loader(use_hash_cache: bool = True) -> ESLoader:
+    """Create ElasticSearch loader selected by ES_LOADER setting."""
+
+    index_name = ES_INDEX_NAME
+    options = {
+        'shadow_indexes': ES_SHADOW_INDEXES,
+        'max_retries': ES_BULK_MAX_RETRIES,
+        'dead_letter_path': ES_DEAD_LETTER_PATH,
+        'hash_cache': create_hash_cache() if use_hash_cache else None,
+    }
+
+    if ES_LOADER == 'async':
+        return AsyncESLoader(
+            ES_PARAMS,
+            index_name,
+            concurrency=ES_BULK_CONCURRENCY,
+            chunk_size=ES_BULK_CHUNK_SIZE,
+            max_chunk_bytes=ES_BULK_MAX_BYTES,
+            **options,
+        )
+
+    if ES_LOADER == 'ndjson':
+        return NDJSONESLoader(
+            ES_PARAMS,
+            index_name,
+            max_chunk_bytes=ES_BULK_MAX_BYTES,
+            **options,
+        )
+
+    return ESLoader(ES_PARAMS, index_name, **options)
+
+
+def create_etl() -> ETL:
+    """Create ETL with new Postgres extractor and ElasticSearch loader."""
+
+    pg_extractor = create_pg_extractor()
+    es_loader = create_es_loader()
+
+    return ETL(pg_extractor, es_loader, PIPELINE_ENABLED, PARTIAL_UPDATES)
+
+
+def main(command: str = 'run', workers: int = 1):
+    state.storage = create_storage(STATE_STORAGE, DSN)
+
+    etl = create_etl()
+    try:
+        run_command(etl, command, workers)
+    finally:
+        etl.close()
 
-    etl = ETL(pg_extractor, es_loader)
+
+def run_command(etl: ETL, command: str, workers: int) -> None:
+    """Run ETL command until it is finished."""
+
+    pg_extractor = etl.pg_extractor
+    es_loader = etl.es_loader
+
+    if command == 'rebuild-hash-cache':
+        if es_loader.hash_cache is None:
+            logging.error('ES_HASH_CACHE_PATH is not set.')
+            return
+        for index_name in es_loader.write_indexes:
+            es_loader.hash_cache.rebuild(es_loader.es, index_name)
+        return
+
+    pg_extractor.apply_migrations()
+
+    if command in ('install-triggers', 'remove-triggers'):
+        pg_extractor.set_change_triggers(command == 'install-triggers')
+        return
+
+    etl.check_state()
+    pg_extractor.check_query_plans({
+        name: (
+            state.get_state(f'last_modified_{name}'),
+            state.get_state(f'last_{name}_id'),
+        )
+        for name in ('person', 'genre', 'filmwork')
+    })
+
+    if command == 'reindex':
+        etl.reindex(workers)
+        return
+
+    if CHANGE_DETECTION == 'notify':
+        # Triggers are never dropped on start, other replicas may listen
+        pg_extractor.set_change_triggers(True)
+        listen(etl)
 
     while True:
         etl.run()
         time.sleep(PAUSE_DURATION)
 
 
+def listen(etl: ETL) -> None:
+    """Reindex changes as soon as Postgres triggers notify about them.
+
+    Changes committed while the listener was not connected are picked up
+    by the modified_at scan on startup and on each fallback interval.
+    """
+
+    listener = ChangeListener(DSN, coalesce_window=NOTIFY_COALESCE_WINDOW)
+    listener.listen()
+    etl.run()
+    next_scan = time.monotonic() + FALLBACK_SCAN_INTERVAL
+
+    while True:
+        try:
+            changes = listener.wait(max(next_scan - time.monotonic(), 0))
+        except psycopg2.OperationalError as exc:
+            logging.error('Lost connection of change listener: %s.', exc)
+            listener.close()
+            listener.listen()
+            next_scan = time.monotonic()
+            continue
+
+        if any(changes.values()):
+            etl.process_changes(changes)
+
+        if time.monotonic() >= next_scan:
+            etl.run()
+            next_scan = time.monotonic() + FALLBACK_SCAN_INTERVAL
+
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Postgres to ES ETL.')
+    parser.add_argument(
+        'command',
+        nargs='?',
+        default='run',
+        choices=[
+            'run',
+            'reindex',
+            'rebuild-hash-cache',
+            'install-triggers',
+            'remove-triggers',
+        ],
+        help='run incremental ETL, rebuild the whole index, '
+             'rebuild the hash cache of indexed documents or '
+             'install or remove change notify triggers',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=REINDEX_WORKERS,
+        help='number of worker processes of full reindex',
+    )
+    args = parser.parse_args()
+    main(args.command, args.workers)
@@ -0,0 +1,17 @@
+-- Indexes for keyset polling of modified objects and for lookups of
+-- filmworks by modified persons and genres.
+
+CREATE INDEX IF NOT EXISTS filmwork_modified_idx
+    ON content.filmwork (modified_at, id);
+
+CREATE INDEX IF NOT EXISTS person_modified_idx
+    ON content.person (modified_at, id);
+
+CREATE INDEX IF NOT EXISTS genre_modified_idx
+    ON content.genre (modified_at, id);
+
+CREATE INDEX IF NOT EXISTS person_filmwork_person_idx
+    ON content.person_filmwork (person_id);
+
+CREATE INDEX IF NOT EXISTS genre_filmwork_genre_idx
+    ON content.genre_filmwork (genre_id);
@@ -0,0 +1,7 @@
+-- Remove ETL change notifications, polling mode does not listen to them.
+
+DROP TRIGGER IF EXISTS filmwork_notify_etl ON content.filmwork;
+DROP TRIGGER IF EXISTS person_notify_etl ON content.person;
+DROP TRIGGER IF EXISTS genre_notify_etl ON content.genre;
+DROP TRIGGER IF EXISTS person_filmwork_notify_etl ON content.person_filmwork;
+DROP TRIGGER IF EXISTS genre_filmwork_notify_etl ON content.genre_filmwork;
@@ -0,0 +1,56 @@
+-- Notify ETL about changed rows so it can reindex them without polling.
+-- Link table changes are reported as changes of the linked filmwork.
+-- Applied on every start in notify mode, so it must stay idempotent.
+
+CREATE OR REPLACE FUNCTION content.notify_etl_change() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+    payload JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME IN ('person_filmwork', 'genre_filmwork') THEN
+        payload := json_build_object(
+            'table', 'filmwork',
+            'id', changed.filmwork_id
+        );
+    ELSE
+        payload := json_build_object(
+            'table', TG_TABLE_NAME,
+            'id', changed.id
+        );
+    END IF;
+
+    PERFORM pg_notify('etl_changes', payload::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS filmwork_notify_etl ON content.filmwork;
+CREATE TRIGGER filmwork_notify_etl
+    AFTER INSERT OR UPDATE ON content.filmwork
+    FOR EACH ROW EXECUTE FUNCTION content.notify_etl_change();
+
+DROP TRIGGER IF EXISTS person_notify_etl ON content.person;
+CREATE TRIGGER person_notify_etl
+    AFTER INSERT OR UPDATE ON content.person
+    FOR EACH ROW EXECUTE FUNCTION content.notify_etl_change();
+
+DROP TRIGGER IF EXISTS genre_notify_etl ON content.genre;
+CREATE TRIGGER genre_notify_etl
+    AFTER INSERT OR UPDATE ON content.genre
+    FOR EACH ROW EXECUTE FUNCTION content.notify_etl_change();
+
+DROP TRIGGER IF EXISTS person_filmwork_notify_etl ON content.person_filmwork;
+CREATE TRIGGER person_filmwork_notify_etl
+    AFTER INSERT OR UPDATE OR DELETE ON content.person_filmwork
+    FOR EACH ROW EXECUTE FUNCTION content.notify_etl_change();
+
+DROP TRIGGER IF EXISTS genre_filmwork_notify_etl ON content.genre_filmwork;
+CREATE TRIGGER genre_filmwork_notify_etl
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre_filmwork
+    FOR EACH ROW EXECUTE FUNCTION content.notify_etl_change();
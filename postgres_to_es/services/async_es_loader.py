@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
+
+from services.es_loader import ESLoader
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(name)s:%(levelname)s - %(message)s'
+)
+
+
+class AsyncESLoader(ESLoader):
+    """ESLoader that keeps several bulk requests in flight at once."""
+
+    def __init__(
+        self,
+        params: dict,
+        index_name: str,
+        concurrency: int = 4,
+        chunk_size: int = 250,
+        max_chunk_bytes: int = 10 * 1024 * 1024,
+        **kwargs,
+    ):
+        super().__init__(params, index_name, **kwargs)
+        self.async_es = AsyncElasticsearch(params)
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.loop = asyncio.new_event_loop()
+
+    async def _send_chunk(
+        self, actions: list, semaphore: asyncio.Semaphore
+    ) -> list:
+        """Send actions to ElasticSearch as one or more bulk requests.
+
+        Results come in the order of actions and are matched by position.
+        """
+
+        failures = []
+        position = 0
+        async with semaphore:
+            async for ok, item in async_streaming_bulk(
+                self.async_es,
+                actions,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+            ):
+                action = actions[position]
+                position += 1
+                if not ok:
+                    result = next(iter(item.values()))
+                    failures.append(
+                        (action, result['status'], result.get('error'))
+                    )
+        return failures
+
+    async def _send(self, actions: list) -> list:
+        """Split actions into chunks and send them concurrently."""
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        chunks = [
+            actions[i:i + self.chunk_size]
+            for i in range(0, len(actions), self.chunk_size)
+        ]
+        results = await asyncio.gather(
+            *(self._send_chunk(chunk, semaphore) for chunk in chunks)
+        )
+        return [failure for failures in results for failure in failures]
+
+    def send_actions(self, actions: list) -> list:
+        """Send bulk actions with parallel requests and return failures."""
+
+        return self.loop.run_until_complete(self._send(actions))
+
+    def close(self) -> None:
+        """Close async ElasticSearch client and its event loop."""
+
+        self.loop.run_until_complete(self.async_es.close())
+        self.loop.close()
+        super().close()
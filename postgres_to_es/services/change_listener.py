@@ -0,0 +1,81 @@
+import json
+import logging
+import select
+import time
+
+import backoff
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(name)s:%(levelname)s - %(message)s'
+)
+
+
+class ChangeListener:
+    """Receive ids of changed rows sent by content triggers via NOTIFY."""
+
+    def __init__(
+        self,
+        dsn: dict,
+        channel: str = 'etl_changes',
+        coalesce_window: float = 0.5,
+    ) -> None:
+        self.dsn = dsn
+        self.channel = channel
+        self.coalesce_window = coalesce_window
+        self.connection = None
+
+    @backoff.on_exception(backoff.expo, psycopg2.OperationalError)
+    def listen(self) -> None:
+        """Open connection and subscribe to the notification channel."""
+
+        self.connection = psycopg2.connect(**self.dsn)
+        self.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel};')
+
+        logging.info('Listening to %s channel.', self.channel)
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+
+    def _poll(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for notifications to arrive."""
+
+        if select.select([self.connection], [], [], timeout)[0]:
+            self.connection.poll()
+        return bool(self.connection.notifies)
+
+    def wait(self, timeout: float) -> dict:
+        """Wait for changes and return changed ids grouped by table.
+
+        After the first notification arrives the listener keeps collecting
+        notifications for the coalesce window, so a burst of edits is
+        processed as one change set.
+        """
+
+        changes = {'person': set(), 'genre': set(), 'filmwork': set()}
+
+        if not self._poll(timeout):
+            return changes
+
+        deadline = time.monotonic() + self.coalesce_window
+        while (remaining := deadline - time.monotonic()) > 0:
+            self._poll(remaining)
+
+        for notify in self.connection.notifies:
+            payload = json.loads(notify.payload)
+            changes[payload['table']].add(payload['id'])
+        self.connection.notifies.clear()
+
+        logging.info(
+            'Received changes of %s persons, %s genres and %s filmworks.',
+            len(changes['person']),
+            len(changes['genre']),
+            len(changes['filmwork']),
+        )
+
+        return changes
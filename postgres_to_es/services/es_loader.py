@@ -1,9 +1,22 @@
 import json
 import logging
 import os
+import time
+from datetime import datetime
 
 import backoff
-from elasticsearch import Elasticsearch, helpers, TransportError
+import orjson
+from elasticsearch import (
+    ApiError,
+    ConnectionError,
+    ConnectionTimeout,
+    Elasticsearch,
+    TransportError,
+    helpers,
+)
+
+from services.hash_cache import DocumentHashCache
+from utils.schemas import ESFilmwork
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -11,69 +24,429 @@ logging.basicConfig(
 )
 
 
+# Statuses of bulk items that may succeed if sent again later
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Transport errors of a cluster under pressure, the request is sent again
+RETRY_ERRORS = (ConnectionError, ConnectionTimeout)
+
+# Merge of a whole index takes far longer than the default request timeout
+FORCEMERGE_TIMEOUT = 6 * 60 * 60
+
+
+# Renames persons by ids in actors and writers lists and their names
+PERSON_NAMES_SCRIPT = """
+    for (field in ['actors', 'writers']) {
+        List names = new ArrayList();
+        for (person in ctx._source[field]) {
+            if (params.names.containsKey(person.id)) {
+                person.name = params.names[person.id];
+            }
+            names.add(person.name);
+        }
+        ctx._source[field + '_names'] = names;
+    }
+"""
+
+
+class BulkLoadError(Exception):
+    """Some documents of a batch could not be loaded after retries."""
+
+
 class ESLoader:
 
-    def __init__(self, params: dict, index_name: str):
+    def __init__(
+        self,
+        params: dict,
+        index_name: str,
+        shadow_indexes: list | None = None,
+        max_retries: int = 5,
+        dead_letter_path: str = 'dead_letter.ndjson',
+        hash_cache: DocumentHashCache | None = None,
+    ):
         self.es = Elasticsearch(params)
         self.index_name = index_name
+        self.shadow_indexes = shadow_indexes or []
+        # Indexes every document is written to, differ during full reindex
+        self.write_indexes = [index_name, *self.shadow_indexes]
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.hash_cache = hash_cache
+
+    def close(self) -> None:
+        """Close ElasticSearch client."""
+
+        self.es.close()
+
+    def load_index_body(self) -> dict:
+        """Load index settings and mappings from the schema file."""
+
+        with open('utils/es_movies_index.json', 'r') as file:
+            return json.load(file)
 
     @backoff.on_exception(wait_gen=backoff.expo, exception=TransportError)
     def create_index(self):
-        """Create ElasticSearch index."""
+        """Create ElasticSearch live and shadow indexes.
+
+        Cached hashes of a created index describe documents of a deleted
+        one, so they are cleared.
+        """
 
-        index_name = self.index_name
         index_path = 'utils/es_movies_index.json'
+        if not os.path.exists(index_path):
+            return
 
-        if (
-            os.path.exists(index_path) and
-            not self.es.indices.exists(index=index_name)
-        ):
-            index_name = self.index_name
-            with open(index_path, 'r') as file:
-                body = json.load(file)
-                self.es.indices.create(
-                    index=index_name,
-                    mappings=body['mappings'],
-                    settings=body['settings'],
-                )
+        for index_name in [self.index_name, *self.shadow_indexes]:
+            if self.es.indices.exists(index=index_name):
+                continue
+
+            body = self.load_index_body()
+            self.es.indices.create(
+                index=index_name,
+                mappings=body['mappings'],
+                settings=body['settings'],
+            )
+            if self.hash_cache:
+                self.hash_cache.clear(index_name)
 
             logging.info('ElasticSearch %s index created.', index_name)
 
-    @backoff.on_exception(wait_gen=backoff.expo, exception=ConnectionError)
-    def insert_bulk_data(self, data: list):
-        """Insert data into ElasticSearch index."""
+    @backoff.on_exception(wait_gen=backoff.expo, exception=TransportError)
+    def create_reindex_index(self) -> str:
+        """Create new versioned index tuned for bulk loading.
+
+        Refresh is disabled and replicas are not allocated until
+        the index is finished by finish_reindex.
+        """
+
+        index_name = '{}_{}'.format(
+            self.index_name,
+            datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+        )
+        body = self.load_index_body()
+        settings = dict(
+            body['settings'],
+            refresh_interval='-1',
+            number_of_replicas=0,
+        )
+        self.es.indices.create(
+            index=index_name,
+            mappings=body['mappings'],
+            settings=settings,
+        )
+
+        logging.info('ElasticSearch %s index created for reindex.', index_name)
+
+        return index_name
+
+    @backoff.on_exception(
+        wait_gen=backoff.expo, exception=TransportError, max_tries=5
+    )
+    def finish_reindex(self, index_name: str) -> None:
+        """Restore index settings, merge segments and swap the alias.
+
+        Every step is idempotent, so the whole method is retried, but a
+        few times only, as each retry may queue one more merge.
+        """
+
+        settings = self.load_index_body()['settings']
+        self.es.indices.put_settings(
+            index=index_name,
+            settings={
+                'refresh_interval': settings.get('refresh_interval', '1s'),
+                'number_of_replicas': settings.get('number_of_replicas', 1),
+            },
+        )
+        self.es.indices.refresh(index=index_name)
+        self.es.options(request_timeout=FORCEMERGE_TIMEOUT).indices.forcemerge(
+            index=index_name, max_num_segments=1
+        )
+        self.swap_alias(index_name)
+
+        # Cached hashes describe documents of the replaced index
+        if self.hash_cache:
+            self.hash_cache.clear(self.index_name)
+
+    def swap_alias(self, index_name: str) -> None:
+        """Atomically point index name alias to the new index.
+
+        Old indexes behind the alias, or an old concrete index with the
+        same name as the alias, are removed in the same request.
+        """
+
+        actions = []
+        if self.es.indices.exists_alias(name=self.index_name):
+            aliases = self.es.indices.get_alias(name=self.index_name)
+            for old_index in aliases:
+                if old_index != index_name:
+                    actions.append({'remove_index': {'index': old_index}})
+        elif self.es.indices.exists(index=self.index_name):
+            actions.append({'remove_index': {'index': self.index_name}})
+
+        actions.append(
+            {'add': {'index': index_name, 'alias': self.index_name}}
+        )
+        self.es.indices.update_aliases(actions=actions)
+
+        logging.info(
+            'ElasticSearch %s alias points to %s index.',
+            self.index_name,
+            index_name,
+        )
+
+    @staticmethod
+    def prepare_document(item: ESFilmwork | dict) -> dict:
+        """Convert filmwork into ElasticSearch document.
+
+        Documents produced by the fast transform are already plain dicts.
+        """
+
+        if isinstance(item, dict):
+            return item
+
+        return {
+            'id': item.id,
+            'imdb_rating': item.imdb_rating,
+            'genre': item.genre,
+            'title': item.title,
+            'description': item.description,
+            'director': item.director,
+            'actors_names': item.actors_names,
+            'writers_names': item.writers_names,
+            'actors': [{
+                'id': person.id,
+                'name': person.full_name,
+            } for person in item.actors],
+            'writers': [{
+                'id': person.id,
+                'name': person.full_name,
+            } for person in item.writers],
+        }
+
+    def prepare_actions(self, data: list) -> list:
+        """Convert filmworks into ElasticSearch bulk index actions.
+
+        Each document is serialized once and the same bytes are used for
+        actions of every write index.
+        """
 
         actions = []
         for item in data:
-            item_dict = {
-                'id': item.id,
-                'imdb_rating': item.imdb_rating,
-                'genre': item.genre,
-                'title': item.title,
-                'description': item.description,
-                'director': item.director,
-                'actors_names': item.actors_names,
-                'writers_names': item.writers_names,
-                'actors': [{
-                    'id': person.id,
-                    'name': person.full_name,
-                } for person in item.actors],
-                'writers': [{
-                    'id': person.id,
-                    'name': person.full_name,
-                } for person in item.writers],
+            item_dict = self.prepare_document(item)
+            source = orjson.dumps(item_dict)
+            for index_name in self.write_indexes:
+                action = {
+                    '_id': str(item_dict['id']),
+                    '_index': index_name,
+                    '_source': source,
+                }
+                actions.append(action)
+
+        return actions
+
+    def send_actions(self, actions: list) -> list:
+        """Send bulk actions and return (action, status, error) failures.
+
+        Results are yielded in the order of actions, so they are matched by
+        position, as responses name concrete indexes instead of aliases.
+        """
+
+        failures = []
+        results = helpers.streaming_bulk(
+            self.es,
+            actions,
+            raise_on_error=False,
+        )
+        for action, (ok, item) in zip(actions, results):
+            if not ok:
+                result = next(iter(item.values()))
+                failures.append(
+                    (action, result['status'], result.get('error'))
+                )
+
+        return failures
+
+    def write_dead_letters(self, failures: list) -> None:
+        """Append rejected actions to dead letter file for replay."""
+
+        with open(self.dead_letter_path, 'a') as file:
+            for action, status, error in failures:
+                record = {
+                    key: value for key, value in action.items()
+                    if key != '_source'
+                }
+                if '_source' in action:
+                    record['_source'] = orjson.loads(action['_source'])
+                record.update({'status': status, 'error': error})
+                file.write(json.dumps(record, default=str) + '\n')
+
+        logging.error(
+            'Wrote %s rejected objects to %s.',
+            len(failures),
+            self.dead_letter_path,
+        )
+
+    def load_actions(self, actions: list) -> list | None:
+        """Send bulk actions to ElasticSearch.
+
+        Items rejected with 429 or 5xx statuses are sent again with
+        exponential delay, other rejected items go to the dead letter file.
+        Updates of documents missing in an index are skipped. Return list
+        of loaded actions or None if some actions still fail after retries.
+        """
+
+        pending = actions
+        rejected_ids = set()
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt, 60))
+
+            try:
+                failures = self.send_actions(pending)
+            except ApiError as exc:
+                if exc.meta.status not in RETRY_STATUSES:
+                    raise
+                failures = [
+                    (action, exc.meta.status, str(exc)) for action in pending
+                ]
+
+            rejected = [
+                failure for failure in failures
+                if failure[1] not in RETRY_STATUSES
+            ]
+            missing = [
+                failure for failure in rejected
+                if failure[1] == 404 and failure[0].get('_op_type') == 'update'
+            ]
+            rejected = [
+                failure for failure in rejected if failure not in missing
+            ]
+            if rejected:
+                self.write_dead_letters(rejected)
+            rejected_ids.update(
+                id(failure[0]) for failure in rejected + missing
+            )
+
+            pending = [
+                failure[0] for failure in failures
+                if failure[1] in RETRY_STATUSES
+            ]
+            if not pending:
+                return [
+                    action for action in actions
+                    if id(action) not in rejected_ids
+                ]
+
+            logging.warning(
+                'ES asked to retry %s objects, attempt %s.',
+                len(pending),
+                attempt + 1,
+            )
+
+        logging.error('Could not load %s objects to ES.', len(pending))
+        return None
+
+    @backoff.on_exception(wait_gen=backoff.expo, exception=RETRY_ERRORS)
+    def insert_bulk_data(self, data: list) -> bool:
+        """Insert data into ElasticSearch index.
+
+        Return True when every document is either loaded or dead-lettered.
+        Documents equal to the indexed ones are skipped with hash cache.
+        """
+
+        actions = self.prepare_actions(data)
+        if self.hash_cache:
+            actions = self.hash_cache.filter_changed(actions)
+
+        loaded = self.load_actions(actions)
+        if loaded is None:
+            return False
+
+        if self.hash_cache:
+            self.hash_cache.update(loaded)
+        logging.info('Loaded %s objects to ES index.', len(loaded))
+        return True
+
+    def find_person_filmworks(self, person_ids: list) -> dict:
+        """Find indexed filmworks of persons by their actor or writer ids.
+
+        Return sets of (filmwork id, role) pairs by person ids.
+        """
+
+        query = {'bool': {'should': [
+            {'nested': {
+                'path': 'actors',
+                'query': {'terms': {'actors.id': person_ids}},
+            }},
+            {'nested': {
+                'path': 'writers',
+                'query': {'terms': {'writers.id': person_ids}},
+            }},
+        ]}}
+
+        person_filmworks = {}
+        for hit in helpers.scan(
+            self.es,
+            index=self.index_name,
+            query={'query': query},
+            _source=['actors.id', 'writers.id'],
+        ):
+            for field, role in (('actors', 'actor'), ('writers', 'writer')):
+                for person in hit['_source'].get(field, []):
+                    person_filmworks.setdefault(person['id'], set()).add(
+                        (hit['_id'], role)
+                    )
+
+        return person_filmworks
+
+    @backoff.on_exception(wait_gen=backoff.expo, exception=RETRY_ERRORS)
+    def update_person_names(self, names: dict, fw_ids: list) -> bool:
+        """Rename actors and writers in indexed filmworks with a script."""
+
+        script = {
+            'lang': 'painless',
+            'source': PERSON_NAMES_SCRIPT,
+            'params': {'names': names},
+        }
+        actions = [
+            {
+                '_op_type': 'update',
+                '_index': index_name,
+                '_id': fw_id,
+                'script': script,
             }
-            action = {
-                '_id': item.id,
-                '_index': 'movies',
-                '_source': item_dict
+            for fw_id in fw_ids
+            for index_name in self.write_indexes
+        ]
+        return self._load_updates(actions, fw_ids)
+
+    @backoff.on_exception(wait_gen=backoff.expo, exception=RETRY_ERRORS)
+    def update_filmwork_genres(self, genres: dict) -> bool:
+        """Replace genre names of indexed filmworks with partial updates."""
+
+        actions = [
+            {
+                '_op_type': 'update',
+                '_index': index_name,
+                '_id': fw_id,
+                'doc': {'genre': genre},
             }
-            actions.append(action)
-
-        try:
-            helpers.bulk(self.es, actions)
-            logging.error('Loaded %s objects to ES index.', len(data))
-            return True
-        except Exception as exc:
-            logging.error('Could not load data to ES: %s.', exc)
+            for fw_id, genre in genres.items()
+            for index_name in self.write_indexes
+        ]
+        return self._load_updates(actions, list(genres))
+
+    def _load_updates(self, actions: list, fw_ids: list) -> bool:
+        """Load partial update actions and forget hashes of documents."""
+
+        if self.hash_cache:
+            for index_name in self.write_indexes:
+                self.hash_cache.invalidate(index_name, fw_ids)
+
+        loaded = self.load_actions(actions)
+        if loaded is None:
             return False
+
+        logging.info('Updated %s objects in ES index.', len(loaded))
+        return True
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import sqlite3
+import time
+
+import orjson
+from elasticsearch import Elasticsearch, helpers
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(name)s:%(levelname)s - %(message)s'
+)
+
+# SQLite limits the number of query parameters
+QUERY_BLOCK_SIZE = 500
+
+
+class DocumentHashCache:
+    """Persistent cache of content hashes of indexed documents.
+
+    Hashes are kept in SQLite by '<index>/<id>' keys, so the loader can
+    skip documents that are byte-identical to the indexed ones. Least
+    recently used entries are evicted above max_entries. The cache must
+    be rebuilt with the rebuild-hash-cache command after the ETL state is
+    reset to reload documents, otherwise they are skipped as unchanged.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1_000_000) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        # The cache is used from the pipeline load worker thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS document_hash (
+                    key TEXT PRIMARY KEY,
+                    hash BLOB NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE INDEX IF NOT EXISTS document_hash_used_at_idx
+                ON document_hash (used_at)
+            """)
+
+    @staticmethod
+    def make_key(index_name: str, doc_id: str) -> str:
+        return f'{index_name}/{doc_id}'
+
+    @staticmethod
+    def make_hash(source: bytes) -> bytes:
+        return hashlib.blake2b(source, digest_size=16).digest()
+
+    def _get_hashes(self, keys: list) -> dict:
+        """Get cached hashes of documents by their keys."""
+
+        hashes = {}
+        for i in range(0, len(keys), QUERY_BLOCK_SIZE):
+            block = keys[i:i + QUERY_BLOCK_SIZE]
+            placeholders = ', '.join('?' * len(block))
+            rows = self.connection.execute(
+                f'SELECT key, hash FROM document_hash '
+                f'WHERE key IN ({placeholders})',
+                block,
+            )
+            hashes.update(rows)
+        return hashes
+
+    def filter_changed(self, actions: list) -> list:
+        """Drop actions whose documents are equal to the indexed ones."""
+
+        keys = [
+            self.make_key(action['_index'], action['_id'])
+            for action in actions
+        ]
+        cached = self._get_hashes(keys)
+
+        changed = []
+        unchanged_keys = []
+        for key, action in zip(keys, actions):
+            if cached.get(key) == self.make_hash(action['_source']):
+                unchanged_keys.append((time.time(), key))
+            else:
+                changed.append(action)
+
+        if unchanged_keys:
+            with self.connection:
+                self.connection.executemany(
+                    'UPDATE document_hash SET used_at = ? WHERE key = ?',
+                    unchanged_keys,
+                )
+            logging.info(
+                'Skipped %s unchanged objects.',
+                len(unchanged_keys),
+            )
+
+        return changed
+
+    def update(self, actions: list) -> None:
+        """Remember hashes of loaded documents and evict old entries."""
+
+        now = time.time()
+        rows = [
+            (
+                self.make_key(action['_index'], action['_id']),
+                self.make_hash(action['_source']),
+                now,
+            )
+            for action in actions
+        ]
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO document_hash (key, hash, used_at) '
+                'VALUES (?, ?, ?)',
+                rows,
+            )
+            self.connection.execute(
+                """
+                DELETE FROM document_hash WHERE key IN (
+                    SELECT key FROM document_hash
+                    ORDER BY used_at
+                    LIMIT MAX((SELECT COUNT(*) FROM document_hash) - ?, 0)
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def invalidate(self, index_name: str, id_list: list) -> None:
+        """Forget hashes of documents changed outside of the loader."""
+
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM document_hash WHERE key = ?',
+                [(self.make_key(index_name, doc_id),) for doc_id in id_list],
+            )
+
+    def clear(self, index_name: str | None = None) -> None:
+        """Forget hashes of one index or of every index."""
+
+        with self.connection:
+            if index_name is None:
+                self.connection.execute('DELETE FROM document_hash')
+            else:
+                self.connection.execute(
+                    'DELETE FROM document_hash WHERE key LIKE ?',
+                    (self.make_key(index_name, '%'),),
+                )
+
+    def rebuild(self, es: Elasticsearch, index_name: str) -> None:
+        """Fill the cache with hashes of documents stored in the index."""
+
+        self.clear(index_name)
+
+        block = []
+        count = 0
+        for hit in helpers.scan(es, index=index_name):
+            block.append({
+                '_index': index_name,
+                '_id': hit['_id'],
+                '_source': orjson.dumps(hit['_source']),
+            })
+            if len(block) == QUERY_BLOCK_SIZE:
+                self.update(block)
+                count += len(block)
+                block = []
+
+        if block:
+            self.update(block)
+            count += len(block)
+
+        logging.info('Rebuilt hash cache of %s %s objects.', count, index_name)
@@ -0,0 +1,83 @@
+import logging
+
+import orjson
+
+from services.es_loader import ESLoader
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(name)s:%(levelname)s - %(message)s'
+)
+
+
+class NDJSONESLoader(ESLoader):
+    """ESLoader posting pre-serialized NDJSON bodies to _bulk API.
+
+    Documents serialized once by prepare_actions are written straight
+    into request bodies and bulk requests are split by their size in
+    bytes instead of documents count.
+    """
+
+    def __init__(
+        self,
+        params: dict,
+        index_name: str,
+        max_chunk_bytes: int = 10 * 1024 * 1024,
+        **kwargs,
+    ):
+        super().__init__(params, index_name, **kwargs)
+        self.max_chunk_bytes = max_chunk_bytes
+
+    def serialize_actions(self, actions: list) -> list:
+        """Serialize bulk actions into NDJSON bodies of limited size.
+
+        Return list of (body, actions) pairs to match response items of
+        each request with its actions.
+        """
+
+        bodies = []
+        buffer = bytearray()
+        body_actions = []
+        for action in actions:
+            op_type = action.get('_op_type', 'index')
+            if op_type == 'index':
+                source = action['_source']
+            else:
+                source = orjson.dumps({
+                    key: action[key]
+                    for key in ('doc', 'script') if key in action
+                })
+            lines = b'%s\n%s\n' % (
+                orjson.dumps({
+                    op_type: {'_index': action['_index'], '_id': action['_id']}
+                }),
+                source,
+            )
+            if buffer and len(buffer) + len(lines) > self.max_chunk_bytes:
+                bodies.append((bytes(buffer), body_actions))
+                buffer.clear()
+                body_actions = []
+            buffer += lines
+            body_actions.append(action)
+
+        if buffer:
+            bodies.append((bytes(buffer), body_actions))
+
+        return bodies
+
+    def send_actions(self, actions: list) -> list:
+        """Post NDJSON bodies to _bulk API and return failures."""
+
+        failures = []
+        for body, body_actions in self.serialize_actions(actions):
+            response = self.es.bulk(operations=body)
+            if not response['errors']:
+                continue
+            for action, item in zip(body_actions, response['items']):
+                result = next(iter(item.values()))
+                if 'error' in result:
+                    failures.append(
+                        (action, result['status'], result['error'])
+                    )
+
+        return failures
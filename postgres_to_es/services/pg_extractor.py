@@ -1,13 +1,23 @@
 import logging
+import os
+import threading
 import uuid
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 
 import backoff
 import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
 from psycopg2.extras import DictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 from utils import queries
-from utils.schemas import ESFilmwork, Person, PGObject
+from utils.schemas import (
+    ESFilmwork,
+    Person,
+    PGObject,
+    es_filmwork_documents,
+)
 
 
 psycopg2.extras.register_uuid()
@@ -18,20 +28,272 @@ logging.basicConfig(
 )
 
 
+# Triggers created by migrations/triggers/enable_change_notify.sql
+CHANGE_TRIGGERS = [
+    'filmwork_notify_etl',
+    'person_notify_etl',
+    'genre_notify_etl',
+    'person_filmwork_notify_etl',
+    'genre_filmwork_notify_etl',
+]
+
+
 class PostgresExtractor:
 
-    def __init__(self, params: dict, block_size: int) -> None:
+    def __init__(
+        self,
+        params: dict,
+        block_size: int,
+        server_side_cursors: bool = True,
+        sql_documents: bool = False,
+        fast_transform: bool = False,
+        pool_max: int = 4,
+        snapshot_isolation: bool = False,
+        modified_lag: int = 0,
+        pool_timeout: float = 30,
+    ) -> None:
         self.dsn = params
         self.block_size = block_size
-        self.connection = self._open_connection()
-    
+        self.server_side_cursors = server_side_cursors
+        self.sql_documents = sql_documents
+        self.fast_transform = fast_transform
+        self.pool_max = pool_max
+        self.pool_timeout = pool_timeout
+        self.snapshot_isolation = snapshot_isolation
+        # Rows modified later than NOW() - modified_lag seconds are skipped
+        self.modified_lag = modified_lag
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        # Makes callers wait for a free connection instead of PoolError
+        self._pool_slots = threading.BoundedSemaphore(pool_max)
+
     @backoff.on_exception(backoff.expo, psycopg2.OperationalError)
-    def _open_connection(self):
-        return psycopg2.connect(**self.dsn, cursor_factory=DictCursor)
-    
-    def _close_connection(self):
-        return self.connection.close()
-    
+    def _get_pool(self) -> ThreadedConnectionPool:
+        """Create connection pool on the first use."""
+
+        with self._pool_lock:
+            if self.pool is None:
+                self.pool = ThreadedConnectionPool(
+                    1,
+                    self.pool_max,
+                    **self.dsn,
+                    cursor_factory=DictCursor,
+                )
+        return self.pool
+
+    @backoff.on_exception(
+        backoff.expo,
+        (psycopg2.OperationalError, psycopg2.InterfaceError),
+    )
+    def _get_connection(self):
+        """Take healthy connection from the pool.
+
+        Connections broken while idle in the pool are closed and
+        replaced with new ones.
+        """
+
+        pool = self._get_pool()
+        connection = pool.getconn()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pool.putconn(connection, close=True)
+            raise
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """Borrow pooled connection and return it to the pool on exit.
+
+        Open transaction is rolled back before the connection is reused,
+        broken connections are discarded. PoolError is raised if no
+        connection is returned to the full pool within pool_timeout.
+        """
+
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            raise PoolError(
+                f'No free connection in the pool of {self.pool_max} '
+                f'connections after {self.pool_timeout} seconds.'
+            )
+
+        try:
+            connection = self._get_connection()
+            broken = False
+            try:
+                yield connection
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                if not broken and not connection.closed:
+                    connection.rollback()
+                self.pool.putconn(
+                    connection,
+                    close=broken or bool(connection.closed),
+                )
+        finally:
+            self._pool_slots.release()
+
+    @contextmanager
+    def snapshot(self, connection, snapshot_id: str | None = None):
+        """Run queries inside read-only REPEATABLE READ transaction.
+
+        With snapshot_id the transaction imports a snapshot exported by
+        another one, otherwise the own snapshot is exported. Yield id of
+        the exported snapshot, or None if snapshot isolation is disabled.
+        """
+
+        if not self.snapshot_isolation:
+            yield None
+            return
+
+        connection.rollback()
+        connection.set_session(
+            isolation_level=ISOLATION_LEVEL_REPEATABLE_READ,
+            readonly=True,
+        )
+        try:
+            with connection.cursor() as cursor:
+                if snapshot_id is None:
+                    cursor.execute('SELECT pg_export_snapshot();')
+                    snapshot_id = cursor.fetchone()[0]
+                else:
+                    cursor.execute(
+                        'SET TRANSACTION SNAPSHOT %s;',
+                        (snapshot_id,),
+                    )
+            yield snapshot_id
+        finally:
+            if not connection.closed:
+                connection.rollback()
+                connection.set_session(
+                    isolation_level='DEFAULT',
+                    readonly='DEFAULT',
+                )
+
+    def get_current_time(self, connection) -> datetime:
+        """Return current time of Postgres server."""
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT NOW();')
+            return cursor.fetchone()[0]
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+
+        with self._pool_lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+
+    def apply_migrations(self, path: str = 'migrations') -> None:
+        """Apply versioned SQL migrations that were not applied yet."""
+
+        with self.connection() as connection:
+            for file_name in sorted(os.listdir(path)):
+                if not file_name.endswith('.sql'):
+                    continue
+                version = file_name.removesuffix('.sql')
+
+                # Each migration is applied in its own transaction
+                with connection, connection.cursor() as cursor:
+                    cursor.execute(queries.create_migrations_table)
+                    cursor.execute(queries.lock_migrations)
+                    cursor.execute(queries.get_applied_migrations)
+                    if version in {row[0] for row in cursor.fetchall()}:
+                        continue
+
+                    with open(os.path.join(path, file_name), 'r') as file:
+                        cursor.execute(file.read())
+                    cursor.execute(queries.insert_migration, (version,))
+
+                logging.info('Applied %s migration.', version)
+
+    def set_change_triggers(
+        self, enabled: bool, path: str = 'migrations/triggers'
+    ) -> None:
+        """Create or drop triggers notifying ETL about changed rows.
+
+        Triggers are only needed in notify mode, otherwise every write
+        would pay for pg_notify without a listener. DDL locks content
+        tables exclusively, so it runs only if installed triggers differ.
+        """
+
+        file_name = (
+            'enable_change_notify.sql' if enabled
+            else 'disable_change_notify.sql'
+        )
+        with self.connection() as connection:
+            with connection, connection.cursor() as cursor:
+                cursor.execute(queries.lock_migrations)
+                cursor.execute(
+                    queries.count_change_triggers, (CHANGE_TRIGGERS,)
+                )
+                installed = cursor.fetchone()[0]
+                if installed == (len(CHANGE_TRIGGERS) if enabled else 0):
+                    return
+                with open(os.path.join(path, file_name), 'r') as file:
+                    cursor.execute(file.read())
+
+        logging.info(
+            'Change notify triggers %s.', 'created' if enabled else 'dropped'
+        )
+
+    def check_query_plans(self, checkpoints: dict | None = None) -> None:
+        """Warn with EXPLAIN output if ETL queries do not use indexes.
+
+        Keyset queries are explained with (last_modified, last_id)
+        checkpoints by table names. An old checkpoint makes a sequential
+        scan the right plan, so the last hour is checked by default.
+        """
+
+        checkpoints = checkpoints or {}
+        recent = (
+            datetime.now(timezone.utc) - timedelta(hours=1),
+            uuid.UUID(int=0),
+        )
+
+        def keyset_params(table_name: str) -> tuple:
+            last_modified, last_id = checkpoints.get(table_name, recent)
+            return (last_modified, last_id, self.modified_lag, self.block_size)
+
+        ids_params = ((uuid.UUID(int=0),),)
+        checks = {
+            'person_modified_idx': (
+                queries.get_modified_persons,
+                keyset_params('person'),
+            ),
+            'genre_modified_idx': (
+                queries.get_modified_genres,
+                keyset_params('genre'),
+            ),
+            'filmwork_modified_idx': (
+                queries.get_modified_filmworks,
+                keyset_params('filmwork'),
+            ),
+            'person_filmwork_person_idx': (
+                queries.get_filmworks_by_modified_persons,
+                ids_params,
+            ),
+            'genre_filmwork_genre_idx': (
+                queries.get_filmworks_by_modified_genres,
+                ids_params,
+            ),
+        }
+
+        with self.connection() as connection, connection.cursor() as cursor:
+            for index_name, (query, params) in checks.items():
+                cursor.execute('EXPLAIN ' + query, params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                if index_name not in plan:
+                    logging.warning(
+                        'Query does not use %s index:\n%s',
+                        index_name,
+                        plan,
+                    )
+
     def _execute_query(self, query, params, connection):
         cursor = connection.cursor()
         cursor.execute(query, params)
@@ -39,14 +301,29 @@ class PostgresExtractor:
     
     @backoff.on_exception(backoff.expo, psycopg2.OperationalError)
     def _execute_query_gen(self, query: str, params, connection):
-        cursor = connection.cursor()
-        cursor.execute(query, params)
-
-        while True:
-            data = cursor.fetchmany(self.block_size)
-            if not data:
-                break
-            yield data
+        """Execute query and yield its results by blocks.
+
+        With server side cursors enabled a named cursor is used, so rows
+        are fetched from Postgres block by block instead of loading the
+        whole result set into client memory.
+        """
+
+        if self.server_side_cursors:
+            cursor = connection.cursor(name=f'etl_{uuid.uuid4().hex}')
+            cursor.itersize = self.block_size
+        else:
+            cursor = connection.cursor()
+
+        try:
+            cursor.execute(query, params)
+
+            while True:
+                data = cursor.fetchmany(self.block_size)
+                if not data:
+                    break
+                yield data
+        finally:
+            cursor.close()
 
     def extract_modified_persons(
         self, last_modified: datetime, last_id: uuid.UUID, connection
@@ -55,7 +332,12 @@ class PostgresExtractor:
 
         results = self._execute_query(
             queries.get_modified_persons,
-            (last_modified, last_modified, last_id, self.block_size),
+            (
+                last_modified,
+                last_id,
+                self.modified_lag,
+                self.block_size,
+            ),
             connection,
         )
 
@@ -76,7 +358,12 @@ class PostgresExtractor:
 
         results = self._execute_query(
             queries.get_modified_genres,
-            (last_modified, last_modified, last_id, self.block_size),
+            (
+                last_modified,
+                last_id,
+                self.modified_lag,
+                self.block_size,
+            ),
             connection,
         )
 
@@ -94,7 +381,12 @@ class PostgresExtractor:
 
         results = self._execute_query(
             queries.get_modified_filmworks,
-            (last_modified, last_modified, last_id, self.block_size),
+            (
+                last_modified,
+                last_id,
+                self.modified_lag,
+                self.block_size,
+            ),
             connection,
         )
 
@@ -108,6 +400,19 @@ class PostgresExtractor:
 
         return filmworks
 
+    def extract_filmworks_in_range(
+        self, last_id: uuid.UUID, end_id: uuid.UUID, connection
+    ) -> list:
+        """Extract next block of filmworks with ids up to end_id."""
+
+        results = self._execute_query(
+            queries.get_filmworks_in_range,
+            (last_id, end_id, self.block_size),
+            connection,
+        )
+
+        return [PGObject(**filmwork) for filmwork in results]
+
     def extract_filmworks_by_modified_persons(self, id_list: list, connection) -> list:
         """Extract filmwork objects by modified persons."""
 
@@ -142,18 +447,77 @@ class PostgresExtractor:
             )
             yield filmworks
 
-    def extract_filmwork_data(self, id_list: list, connection) -> list:
-        """Extract full data of filmworks with selected filmwork ids."""
+    def extract_person_links(self, id_list: list, connection) -> dict:
+        """Extract names and filmwork links of persons.
+
+        Return dicts with full_name and set of (filmwork id, role) pairs
+        by person ids.
+        """
+
+        results = self._execute_query(
+            queries.get_person_links,
+            (list(id_list),),
+            connection,
+        )
+
+        persons = {}
+        for row in results:
+            person = persons.setdefault(
+                str(row['id']),
+                {'full_name': row['full_name'], 'links': set()},
+            )
+            if row['filmwork_id']:
+                person['links'].add((str(row['filmwork_id']), row['role']))
+
+        return persons
+
+    def extract_filmwork_genres(self, id_list: list, connection) -> dict:
+        """Extract genre names of filmworks by filmwork ids."""
+
+        results = self._execute_query(
+            queries.get_filmwork_genres,
+            (list(id_list),),
+            connection,
+        )
+
+        genres = dict.fromkeys(id_list, [])
+        genres.update((str(row['id']), row['genre']) for row in results)
+        return genres
+
+    def extract_filmwork_rows(self, id_list: list, connection) -> list:
+        """Extract raw rows of filmworks with selected filmwork ids."""
 
         if not id_list:
             return []
 
-        filmworks = self._execute_query(
+        if self.sql_documents:
+            return self._execute_query(
+                queries.get_filmwork_documents,
+                {'ids': list(id_list)},
+                connection,
+            )
+
+        return self._execute_query(
             queries.get_filmworks,
             (tuple(id_list),),
             connection,
         )
 
+    def transform_filmworks(self, filmworks: list) -> list:
+        """Transform raw filmwork rows into ESFilmwork objects.
+
+        Rows of get_filmwork_documents query already have the document
+        shape, so persons are not split by roles in Python.
+        """
+
+        if self.fast_transform:
+            return self.transform_documents(filmworks)
+
+        if self.sql_documents:
+            filmwork_data = [ESFilmwork(**filmwork) for filmwork in filmworks]
+            logging.info('Extracted %s full filmworks data.', len(filmworks))
+            return filmwork_data
+
         filmwork_data = []
         for filmwork in filmworks:
             params = dict(filmwork)
@@ -186,3 +550,66 @@ class PostgresExtractor:
         logging.info('Extracted %s full filmworks data.', len(filmworks))
 
         return filmwork_data
+
+    def transform_documents(self, filmworks: list) -> list:
+        """Transform raw filmwork rows straight into ES-ready dicts.
+
+        Documents are validated once per batch instead of building
+        pydantic models for every filmwork and person.
+        """
+
+        documents = []
+        for filmwork in filmworks:
+            if self.sql_documents:
+                director = filmwork['director']
+                actors = [
+                    {'id': person['id'], 'name': person['full_name']}
+                    for person in filmwork['actors']
+                ]
+                writers = [
+                    {'id': person['id'], 'name': person['full_name']}
+                    for person in filmwork['writers']
+                ]
+                genre = filmwork['genre']
+            else:
+                director = ''
+                actors = []
+                writers = []
+                for person in filmwork['persons'] or []:
+                    role = person['role']
+                    if role == 'director':
+                        director = person['full_name']
+                        continue
+                    person_doc = {
+                        'id': person['id'],
+                        'name': person['full_name'],
+                    }
+                    if role == 'actor':
+                        actors.append(person_doc)
+                    elif role == 'writer':
+                        writers.append(person_doc)
+                genre = filmwork['genres']
+
+            documents.append({
+                'id': filmwork['id'],
+                'imdb_rating': filmwork['imdb_rating'],
+                'genre': genre,
+                'title': filmwork['title'],
+                'description': filmwork['description'],
+                'director': director,
+                'actors_names': [actor['name'] for actor in actors],
+                'writers_names': [writer['name'] for writer in writers],
+                'actors': actors,
+                'writers': writers,
+            })
+
+        documents = es_filmwork_documents.validate_python(documents)
+        logging.info('Extracted %s full filmworks data.', len(documents))
+
+        return documents
+
+    def extract_filmwork_data(self, id_list: list, connection) -> list:
+        """Extract full data of filmworks with selected filmwork ids."""
+
+        filmworks = self.extract_filmwork_rows(id_list, connection)
+        return self.transform_filmworks(filmworks)
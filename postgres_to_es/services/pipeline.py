@@ -0,0 +1,140 @@
+import logging
+import queue
+import threading
+from contextlib import contextmanager, nullcontext
+
+from services.es_loader import BulkLoadError, ESLoader
+from services.pg_extractor import PostgresExtractor
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(name)s:%(levelname)s - %(message)s'
+)
+
+# Marker passed down the queues to stop the next stage.
+STOP = object()
+
+
+class ETLPipeline:
+    """Staged ETL pipeline connected with bounded queues.
+
+    Filmwork id blocks are submitted by the caller (id discovery stage)
+    and then go through the enrichment, transform and load stages, each
+    running in its own thread, so the next block is fetched from Postgres
+    while the previous one is being indexed by ElasticSearch.
+    """
+
+    def __init__(
+        self,
+        pg_extractor: PostgresExtractor,
+        es_loader: ESLoader,
+        queue_size: int,
+        snapshot_id: str | None = None,
+    ) -> None:
+        self.pg_extractor = pg_extractor
+        self.es_loader = es_loader
+        # Snapshot of the id discovery transaction shared by enrichment
+        self.snapshot_id = snapshot_id
+        self.ids_queue = queue.Queue(maxsize=queue_size)
+        self.rows_queue = queue.Queue(maxsize=queue_size)
+        self.data_queue = queue.Queue(maxsize=queue_size)
+        self.errors = []
+        self.workers = []
+        self.stopped = False
+
+    def start(self) -> None:
+        """Start enrichment, transform and load workers."""
+
+        stages = {
+            'enrich': (
+                self.enrich,
+                self.ids_queue,
+                self.rows_queue,
+                self.open_connection,
+            ),
+            'transform': (
+                self.transform, self.rows_queue, self.data_queue, nullcontext,
+            ),
+            'load': (self.load, self.data_queue, None, nullcontext),
+        }
+        for name, stage in stages.items():
+            worker = threading.Thread(
+                target=self._run_stage,
+                args=stage,
+                name=f'etl-{name}',
+                daemon=True,
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, fw_ids: list) -> None:
+        """Put block of filmwork ids into the pipeline."""
+
+        if self.errors:
+            raise self.errors[0]
+        self.ids_queue.put(fw_ids)
+
+    def join(self) -> None:
+        """Wait until every submitted block is loaded."""
+
+        self.stop()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def stop(self) -> None:
+        """Stop stages after submitted blocks and wait for their threads.
+
+        Stages that failed skip the remaining blocks, so stop never hangs
+        and releases the connection of the enrichment stage.
+        """
+
+        if self.stopped:
+            return
+        self.stopped = True
+
+        self.ids_queue.put(STOP)
+        for worker in self.workers:
+            worker.join()
+
+    def _run_stage(
+        self, handler, input_queue, output_queue, context_factory
+    ) -> None:
+        """Process queue items with handler until STOP marker received."""
+
+        item = None
+        try:
+            with context_factory() as context:
+                while (item := input_queue.get()) is not STOP:
+                    if self.errors:
+                        continue
+                    result = handler(item, context)
+                    if output_queue is not None:
+                        output_queue.put(result)
+        except Exception as exc:
+            logging.error('ETL pipeline stage failed: %s.', exc)
+            self.errors.append(exc)
+            # Drain the queue so upstream stages never block.
+            while item is not STOP:
+                item = input_queue.get()
+        finally:
+            if output_queue is not None:
+                output_queue.put(STOP)
+
+    @contextmanager
+    def open_connection(self):
+        """Borrow own Postgres connection for the enrichment stage."""
+
+        with self.pg_extractor.connection() as connection:
+            with self.pg_extractor.snapshot(connection, self.snapshot_id):
+                yield connection
+
+    def enrich(self, fw_ids: list, connection) -> list:
+        return self.pg_extractor.extract_filmwork_rows(fw_ids, connection)
+
+    def transform(self, rows: list, context) -> list:
+        return self.pg_extractor.transform_filmworks(rows)
+
+    def load(self, filmworks: list, context) -> None:
+        if not self.es_loader.insert_bulk_data(filmworks):
+            raise BulkLoadError('Could not load filmworks block to ES.')
@@ -0,0 +1,43 @@
+import logging
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(name)s:%(levelname)s - %(message)s'
+)
+
+
+class ChangeSetPlanner:
+    """Collect ids of affected filmworks into one deduplicated change set.
+
+    Person, genre and filmwork producers only add ids to the planner, so
+    a filmwork affected by several changes is enriched and indexed once.
+    """
+
+    def __init__(self, block_size: int) -> None:
+        self.block_size = block_size
+        # dict keeps insertion order of ids unlike set
+        self.filmwork_ids = {}
+        self.added = 0
+
+    def __len__(self) -> int:
+        return len(self.filmwork_ids)
+
+    def add(self, id_list: list) -> None:
+        """Add filmwork ids to the change set."""
+
+        self.added += len(id_list)
+        self.filmwork_ids.update(dict.fromkeys(id_list))
+
+    def blocks(self):
+        """Yield deduplicated filmwork ids by blocks."""
+
+        if self.filmwork_ids:
+            logging.info(
+                'Planned %s filmworks to reindex, %s duplicates skipped.',
+                len(self),
+                self.added - len(self),
+            )
+
+        id_list = list(self.filmwork_ids)
+        for i in range(0, len(id_list), self.block_size):
+            yield id_list[i:i + self.block_size]
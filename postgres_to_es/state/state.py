@@ -1,18 +1,30 @@
 import abc
+import fcntl
 import json
 import os
+import tempfile
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import Json
 
 
 class BaseStorage:
+    """Storage of state values by keys.
+
+    save_state writes only the given keys, so workers changing different
+    keys of one state never overwrite each other.
+    """
+
     @abc.abstractmethod
     def save_state(self, state: dict) -> None:
-        """Save state to local storage."""
+        """Save values of the given keys to storage."""
 
         pass
 
     @abc.abstractmethod
     def retrieve_state(self) -> dict:
-        """Retrieve state from local storage."""
+        """Retrieve all state values from storage."""
 
         pass
 
@@ -21,11 +33,52 @@ class JsonFileStorage(BaseStorage):
     def __init__(self, file_path: str | None):
         self.file_path = file_path
 
+    @contextmanager
+    def _lock(self):
+        """Serialize read-modify-write of the file between processes."""
+
+        with open(f'{self.file_path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
     def save_state(self, state: dict) -> None:
-        with open(self.file_path, 'w+') as json_file:
-            json.dump(state, json_file)
+        """Merge values into the file and atomically replace it."""
+
+        with self._lock():
+            merged = self.retrieve_state()
+            merged.update(state)
+            self._write(merged)
+
+    def _write(self, state: dict) -> None:
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as json_file:
+                json.dump(state, json_file)
+                json_file.flush()
+                os.fsync(json_file.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # Persist the rename itself
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
     def retrieve_state(self) -> dict:
+        """Load state from the file.
+
+        Missing file means that nothing was saved yet, e.g. for a reindex
+        partition that has just started, so an empty state is returned.
+        """
+
         json_object = {}
         if os.path.isfile(self.file_path):
             with open(self.file_path, 'r+') as json_file:
@@ -33,30 +86,210 @@ class JsonFileStorage(BaseStorage):
                     json_object = json.load(json_file)
                 except json.JSONDecodeError:
                     pass
-        else:
-            print('xd')
-            print(self.file_path)
-            raise ValueError
         return json_object
 
 
+class PostgresStorage(BaseStorage):
+    """Keep each state value in its own row of Postgres table.
+
+    States with different names are kept apart by the name column.
+    """
+
+    create_table_query = """
+        CREATE TABLE IF NOT EXISTS content.etl_state_values (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value JSONB,
+            modified_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            PRIMARY KEY (name, key)
+        );
+    """
+
+    save_query = """
+        INSERT INTO content.etl_state_values (name, key, value, modified_at)
+        VALUES (%s, %s, %s, NOW())
+        ON CONFLICT (name, key) DO UPDATE
+        SET value = EXCLUDED.value, modified_at = EXCLUDED.modified_at;
+    """
+
+    retrieve_query = """
+        SELECT key, value FROM content.etl_state_values WHERE name = %s;
+    """
+
+    def __init__(self, dsn: dict, key: str = 'etl'):
+        self.dsn = dsn
+        self.key = key
+        self.connection = None
+
+    def _get_connection(self):
+        """Open connection and create state table on the first use."""
+
+        if self.connection is None or self.connection.closed:
+            self.connection = psycopg2.connect(**self.dsn)
+            with self.connection, self.connection.cursor() as cursor:
+                cursor.execute(self.create_table_query)
+        return self.connection
+
+    def save_state(self, state: dict) -> None:
+        connection = self._get_connection()
+        with connection, connection.cursor() as cursor:
+            cursor.executemany(
+                self.save_query,
+                [(self.key, key, Json(value)) for key, value in state.items()],
+            )
+
+    def retrieve_state(self) -> dict:
+        connection = self._get_connection()
+        with connection, connection.cursor() as cursor:
+            cursor.execute(self.retrieve_query, (self.key,))
+            return dict(cursor.fetchall())
+
+
+class KeyValueStorage(BaseStorage):
+    """Keep state values as JSON strings in a hash of Redis-like client."""
+
+    def __init__(self, client, key: str = 'etl_state'):
+        self.client = client
+        self.key = key
+
+    def save_state(self, state: dict) -> None:
+        self.client.hset(
+            self.key,
+            mapping={key: json.dumps(value) for key, value in state.items()},
+        )
+
+    def retrieve_state(self) -> dict:
+        return {
+            self._decode(key): json.loads(value)
+            for key, value in self.client.hgetall(self.key).items()
+        }
+
+    @staticmethod
+    def _decode(key: str | bytes) -> str:
+        return key.decode() if isinstance(key, bytes) else key
+
+
+class InMemoryKeyValueClient:
+    """In-process fake of Redis client for tests and local runs."""
+
+    def __init__(self):
+        self.data = {}
+
+    def hset(self, name: str, mapping: dict) -> int:
+        fields = self.data.setdefault(name, {})
+        added = len(mapping.keys() - fields.keys())
+        for key, value in mapping.items():
+            if isinstance(value, str):
+                value = value.encode()
+            fields[key.encode()] = value
+        return added
+
+    def hgetall(self, name: str) -> dict:
+        return dict(self.data.get(name, {}))
+
+
+def create_storage(
+    backend: str,
+    dsn: dict | None = None,
+    name: str | None = None,
+) -> BaseStorage:
+    """Create state storage by backend name.
+
+    Supported backends are json, postgres, redis and memory. Storages
+    with different names keep independent states.
+    """
+
+    if backend == 'json':
+        return JsonFileStorage(f'state/{name or "state"}.json')
+
+    if backend == 'postgres':
+        return PostgresStorage(dsn, name or 'etl')
+
+    if backend == 'redis':
+        import redis
+
+        client = redis.Redis.from_url(os.environ.get('REDIS_URL'))
+        return KeyValueStorage(client, name or 'etl_state')
+
+    if backend == 'memory':
+        return KeyValueStorage(InMemoryKeyValueClient(), name or 'etl_state')
+
+    raise ValueError(f'Unknown state storage {backend}.')
+
+
 class State:
+    """Key-value state cached in memory and saved to storage on change."""
 
     def __init__(self, storage: BaseStorage):
         self.storage = storage
+        self._data = None
+        self._changed = set()
+        self._transaction_depth = 0
+
+    @property
+    def data(self) -> dict:
+        """State loaded from storage on the first access."""
+
+        if self._data is None:
+            self._data = self.storage.retrieve_state()
+        return self._data
 
     def set_state(self, key: str, value: any) -> None:
         """Set state for a key in storage."""
 
-        data = self.storage.retrieve_state()
-        data.update({key: value})
-        self.storage.save_state(data)
+        if key in self.data and self.data[key] == value:
+            return
+
+        self.data[key] = value
+        self._changed.add(key)
+
+        if not self._transaction_depth:
+            self.flush()
 
     def get_state(self, key: str) -> any:
         """Get state by the key."""
 
-        data = self.storage.retrieve_state()
-        return data.get(key, None)
+        return self.data.get(key, None)
+
+    def flush(self) -> None:
+        """Save changed keys to storage."""
+
+        if self._changed:
+            self.storage.save_state(
+                {key: self.data[key] for key in self._changed}
+            )
+            self._changed = set()
+
+    def refresh(self) -> None:
+        """Reload state to see keys saved by other workers.
+
+        Pending changes are saved first.
+        """
+
+        self.flush()
+        self._data = None
+
+    @contextmanager
+    def transaction(self):
+        """Group several set_state calls into one storage write.
+
+        Changes are saved when the outermost transaction exits and are
+        discarded if it exits with an exception.
+        """
+
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            if self._transaction_depth == 1:
+                self._data = None
+                self._changed = set()
+            raise
+        finally:
+            self._transaction_depth -= 1
+
+        if not self._transaction_depth:
+            self.flush()
 
 
 storage = JsonFileStorage('state/state.json')
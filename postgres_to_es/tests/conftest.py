@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Modules of the ETL are imported relative to the postgres_to_es directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('ES_SCHEME', 'http')
+os.environ.setdefault('ES_HOST', 'localhost')
+os.environ.setdefault('ES_PORT', '9200')
+os.environ.setdefault('ES_INDEX_NAME', 'movies')
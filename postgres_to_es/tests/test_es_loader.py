@@ -0,0 +1,174 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+from elasticsearch import ConnectionTimeout
+
+from services import es_loader
+from services.es_loader import ESLoader
+from services.hash_cache import DocumentHashCache
+
+ES_PARAMS = [{'scheme': 'http', 'host': 'localhost', 'port': 9200}]
+
+
+class ScriptedLoader(ESLoader):
+    """Loader failing sent actions by scripted statuses of their ids."""
+
+    def __init__(self, statuses: dict, **kwargs) -> None:
+        super().__init__(ES_PARAMS, 'movies', **kwargs)
+        # Lists of statuses returned for ids on each attempt
+        self.statuses = statuses
+        self.sent = []
+
+    def send_actions(self, actions: list) -> list:
+        self.sent.append([action['_id'] for action in actions])
+        failures = []
+        for action in actions:
+            statuses = self.statuses.get(action['_id'])
+            if statuses:
+                failures.append((action, statuses.pop(0), 'error'))
+        return failures
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(es_loader.time, 'sleep', lambda seconds: None)
+
+
+def make_action(doc_id: str, op_type: str = 'index') -> dict:
+    action = {'_index': 'movies', '_id': doc_id, '_source': b'{}'}
+    if op_type != 'index':
+        action.update({'_op_type': op_type, 'doc': {}})
+        del action['_source']
+    return action
+
+
+def test_retried_actions_are_loaded(tmp_path):
+    loader = ScriptedLoader(
+        {'a': [429, 503]},
+        dead_letter_path=str(tmp_path / 'dead_letter.ndjson'),
+    )
+    actions = [make_action('a'), make_action('b')]
+
+    assert loader.load_actions(actions) == actions
+    assert loader.sent == [['a', 'b'], ['a'], ['a']]
+
+
+def test_rejected_actions_are_dead_lettered(tmp_path):
+    dead_letter_path = tmp_path / 'dead_letter.ndjson'
+    loader = ScriptedLoader(
+        {'a': [400]}, dead_letter_path=str(dead_letter_path)
+    )
+    actions = [make_action('a'), make_action('b')]
+
+    assert loader.load_actions(actions) == [actions[1]]
+    records = [json.loads(line) for line in dead_letter_path.open()]
+    assert [(record['_id'], record['status']) for record in records] == [
+        ('a', 400),
+    ]
+
+
+def test_updates_of_missing_documents_are_skipped(tmp_path):
+    dead_letter_path = tmp_path / 'dead_letter.ndjson'
+    loader = ScriptedLoader(
+        {'a': [404]}, dead_letter_path=str(dead_letter_path)
+    )
+    actions = [make_action('a', 'update'), make_action('b', 'update')]
+
+    assert loader.load_actions(actions) == [actions[1]]
+    assert not dead_letter_path.exists()
+
+
+def test_actions_failing_after_retries_are_not_loaded(tmp_path):
+    loader = ScriptedLoader(
+        {'a': [429] * 3},
+        max_retries=2,
+        dead_letter_path=str(tmp_path / 'dead_letter.ndjson'),
+    )
+
+    assert loader.load_actions([make_action('a')]) is None
+
+
+def test_failures_of_aliased_index_are_matched(monkeypatch):
+    loader = ESLoader(ES_PARAMS, 'movies')
+    actions = [make_action('x'), make_action('y')]
+
+    def streaming_bulk(client, bulk_actions, **kwargs):
+        # Responses name the concrete index behind the alias
+        yield False, {'index': {
+            '_index': 'movies_20261018000000',
+            '_id': 'x',
+            'status': 429,
+            'error': 'rejected',
+        }}
+        yield True, {'index': {
+            '_index': 'movies_20261018000000',
+            '_id': 'y',
+            'status': 200,
+        }}
+
+    monkeypatch.setattr(es_loader.helpers, 'streaming_bulk', streaming_bulk)
+
+    assert loader.send_actions(actions) == [(actions[0], 429, 'rejected')]
+
+
+def test_bulk_load_is_retried_after_timeout(tmp_path):
+    loader = ScriptedLoader(
+        {}, dead_letter_path=str(tmp_path / 'dead_letter.ndjson')
+    )
+    send_actions = loader.send_actions
+    timeouts = [ConnectionTimeout('timed out')]
+
+    def flaky_send_actions(actions: list) -> list:
+        if timeouts:
+            raise timeouts.pop()
+        return send_actions(actions)
+
+    loader.send_actions = flaky_send_actions
+
+    assert loader.insert_bulk_data([{'id': 'a'}])
+    assert loader.sent == [['a']]
+
+
+class FakeIndices:
+
+    def __init__(self) -> None:
+        self.created = []
+
+    def exists(self, index: str) -> bool:
+        return index in self.created
+
+    def create(self, index: str, **kwargs) -> None:
+        self.created.append(index)
+
+
+def test_created_index_forgets_cached_hashes(tmp_path, monkeypatch):
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(__file__)))
+    hash_cache = DocumentHashCache(str(tmp_path / 'hash_cache.db'))
+    loader = ESLoader(ES_PARAMS, 'movies', hash_cache=hash_cache)
+    loader.es = mock.Mock(indices=FakeIndices())
+    action = make_action('a')
+    hash_cache.update([action])
+
+    loader.create_index()
+
+    assert loader.es.indices.created == ['movies']
+    assert hash_cache.filter_changed([action]) == [action]
+
+
+def test_reindex_merge_waits_longer_than_default_timeout(monkeypatch):
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(__file__)))
+    loader = ESLoader(ES_PARAMS, 'movies')
+    loader.es = mock.Mock()
+    loader.es.indices.exists_alias.return_value = False
+    loader.es.indices.exists.return_value = False
+
+    loader.finish_reindex('movies_1')
+
+    loader.es.options.assert_called_once_with(
+        request_timeout=es_loader.FORCEMERGE_TIMEOUT
+    )
+    loader.es.options().indices.forcemerge.assert_called_once_with(
+        index='movies_1', max_num_segments=1
+    )
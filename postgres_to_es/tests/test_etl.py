@@ -0,0 +1,170 @@
+import uuid
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+import main
+from main import ETL
+from services.es_loader import BulkLoadError
+from services.pg_extractor import CHANGE_TRIGGERS, PostgresExtractor
+from services.planner import ChangeSetPlanner
+from state.state import State, create_storage
+
+
+class FakeConnection:
+    closed = 0
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query: str, params=None) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+
+class TriggerConnection(FakeConnection):
+    """Connection recording queries and reporting installed triggers."""
+
+    def __init__(self, installed: int) -> None:
+        self.installed = installed
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, query: str, params=None) -> None:
+        self.queries.append(query)
+
+    def fetchone(self) -> tuple:
+        return (self.installed,)
+
+
+class FakePool:
+
+    def __init__(self, connection: FakeConnection | None = None) -> None:
+        self.used = 0
+        self.closed = 0
+        self.connection = connection
+
+    def getconn(self) -> FakeConnection:
+        self.used += 1
+        return self.connection or FakeConnection()
+
+    def putconn(self, connection, close: bool = False) -> None:
+        self.used -= 1
+        self.closed += close
+
+
+class FakeExtractor(PostgresExtractor):
+    """Extractor over a fake pool returning ids as filmworks."""
+
+    def __init__(self) -> None:
+        super().__init__({}, block_size=2, pool_max=1, pool_timeout=1)
+        self.pool = FakePool()
+
+    def extract_filmwork_rows(self, fw_ids: list, connection) -> list:
+        return fw_ids
+
+    def transform_filmworks(self, rows: list) -> list:
+        return rows
+
+
+class FlakyLoader:
+
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+        self.loaded = []
+
+    def insert_bulk_data(self, data: list) -> bool:
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.loaded.extend(data)
+        return True
+
+    def create_index(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize('pipeline_enabled', [True, False])
+def test_cycle_after_failed_load_finishes(pipeline_enabled):
+    pg_extractor = FakeExtractor()
+    es_loader = FlakyLoader(failures=1)
+    etl = ETL(pg_extractor, es_loader, pipeline_enabled)
+    ids = [f'id-{i}' for i in range(10)]
+
+    planner = ChangeSetPlanner(pg_extractor.block_size)
+    planner.add(ids)
+    with pytest.raises(BulkLoadError):
+        etl.load_planned(planner, None)
+
+    assert etl.pipeline is None
+    assert pg_extractor.pool.used == 0
+
+    planner = ChangeSetPlanner(pg_extractor.block_size)
+    planner.add(ids)
+    etl.load_planned(planner, None)
+
+    assert es_loader.loaded == ids
+    assert pg_extractor.pool.used == 0
+
+
+def test_checkpoints_are_rewound_after_reindex(monkeypatch):
+    etl_state = State(create_storage('memory'))
+    monkeypatch.setattr(main, 'state', etl_state)
+    monkeypatch.setattr(main, 'MODIFIED_LAG_SECONDS', 60)
+    etl_state.set_state('last_modified_person', '2024-05-01 00:00:00+00:00')
+    etl_state.set_state('reindex_rewind', '2024-04-01 00:01:00+00:00')
+
+    ETL(FakeExtractor(), FlakyLoader(failures=0)).apply_reindex_rewind()
+
+    for name in ('person', 'genre', 'filmwork'):
+        assert etl_state.get_state(f'last_modified_{name}') == (
+            '2024-04-01 00:00:00+00:00'
+        )
+        assert etl_state.get_state(f'last_{name}_id') == str(uuid.UUID(int=0))
+    assert etl_state.get_state('reindex_rewind') is None
+
+
+@pytest.mark.parametrize('enabled, installed, changed', [
+    (True, len(CHANGE_TRIGGERS), False),
+    (True, 0, True),
+    (False, 0, False),
+    (False, len(CHANGE_TRIGGERS), True),
+])
+def test_change_triggers_ddl_runs_only_on_change(enabled, installed, changed):
+    connection = TriggerConnection(installed)
+    pg_extractor = FakeExtractor()
+    pg_extractor.pool = FakePool(connection)
+
+    pg_extractor.set_change_triggers(enabled)
+
+    ddl = [query for query in connection.queries if 'TRIGGER' in query]
+    assert bool(ddl) == changed
+
+
+def test_cycle_stops_when_postgres_connection_is_lost(monkeypatch):
+    etl_state = State(create_storage('memory'))
+    monkeypatch.setattr(main, 'state', etl_state)
+    pg_extractor = FakeExtractor()
+    etl = ETL(pg_extractor, FlakyLoader(failures=0))
+
+    def run_page(pg_connection) -> bool:
+        raise psycopg2.OperationalError('server closed the connection')
+
+    monkeypatch.setattr(etl, 'run_page', run_page)
+    etl.check_state()
+    checkpoint = dict(etl_state.data)
+
+    etl.run()
+
+    assert etl_state.data == checkpoint
+    assert pg_extractor.pool.used == 0
+    assert pg_extractor.pool.closed == 1
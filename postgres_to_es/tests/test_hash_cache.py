@@ -0,0 +1,67 @@
+import itertools
+
+import pytest
+
+from services import hash_cache
+from services.hash_cache import DocumentHashCache
+
+
+def make_action(doc_id: str, source: bytes, index: str = 'movies') -> dict:
+    return {'_index': index, '_id': doc_id, '_source': source}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DocumentHashCache(str(tmp_path / 'hash_cache.db'))
+    yield cache
+    cache.connection.close()
+
+
+def test_unchanged_documents_are_skipped(cache):
+    cache.update([make_action('1', b'{"a":1}'), make_action('2', b'{"b":1}')])
+
+    actions = [
+        make_action('1', b'{"a":1}'),
+        make_action('2', b'{"b":2}'),
+        make_action('3', b'{"c":1}'),
+        make_action('1', b'{"a":1}', index='movies_2'),
+    ]
+
+    assert cache.filter_changed(actions) == actions[1:]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    # Every access gets its own time, so eviction order is predictable
+    clock = itertools.count()
+    monkeypatch.setattr(hash_cache.time, 'time', lambda: next(clock))
+    cache = DocumentHashCache(str(tmp_path / 'hash_cache.db'), max_entries=2)
+    cache.update([make_action('1', b'1')])
+    cache.update([make_action('2', b'2')])
+    # Hit of the first document makes the second one least recently used
+    cache.filter_changed([make_action('1', b'1')])
+    cache.update([make_action('3', b'3')])
+
+    actions = [make_action(doc_id, doc_id.encode()) for doc_id in '123']
+
+    assert cache.filter_changed(actions) == [actions[1]]
+
+
+def test_invalidate_forgets_documents(cache):
+    actions = [make_action('1', b'1'), make_action('2', b'2')]
+    cache.update(actions)
+
+    cache.invalidate('movies', ['1'])
+
+    assert cache.filter_changed(actions) == [actions[0]]
+
+
+def test_clear_forgets_one_index(cache):
+    movies = make_action('1', b'1')
+    other = make_action('1', b'1', index='movies_2')
+    cache.update([movies, other])
+
+    cache.clear('movies')
+    assert cache.filter_changed([movies, other]) == [movies]
+
+    cache.clear()
+    assert cache.filter_changed([movies, other]) == [movies, other]
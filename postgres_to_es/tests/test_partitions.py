@@ -0,0 +1,24 @@
+import uuid
+
+import pytest
+
+from main import partition_bounds
+
+
+@pytest.mark.parametrize('workers', [1, 3, 4, 7])
+def test_partitions_cover_uuid_space(workers):
+    bounds = [partition_bounds(i, workers) for i in range(workers)]
+
+    assert bounds[0][0] == uuid.UUID(int=0)
+    assert bounds[-1][1] == uuid.UUID(int=2 ** 128 - 1)
+    # Each partition starts after the end of the previous one
+    for (_, end_id), (start_id, _) in zip(bounds, bounds[1:]):
+        assert start_id == end_id
+    assert all(start_id < end_id for start_id, end_id in bounds)
+
+
+def test_partitions_are_equal():
+    assert partition_bounds(1, 4) == (
+        uuid.UUID('40000000-0000-0000-0000-000000000000'),
+        uuid.UUID('80000000-0000-0000-0000-000000000000'),
+    )
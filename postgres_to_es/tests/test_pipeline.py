@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from services.es_loader import BulkLoadError
+from services.pipeline import ETLPipeline
+
+
+class FakeExtractor:
+
+    def __init__(self, fail_on: int | None = None) -> None:
+        self.fail_on = fail_on
+
+    @contextmanager
+    def connection(self):
+        yield None
+
+    @contextmanager
+    def snapshot(self, connection, snapshot_id=None):
+        yield snapshot_id
+
+    def extract_filmwork_rows(self, fw_ids: list, connection) -> list:
+        return list(fw_ids)
+
+    def transform_filmworks(self, rows: list) -> list:
+        if self.fail_on in rows:
+            raise ValueError('transform failed')
+        return rows
+
+
+class FakeLoader:
+
+    def __init__(self, result: bool = True) -> None:
+        self.result = result
+        self.loaded = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def insert_bulk_data(self, data: list) -> bool:
+        self.release.wait()
+        self.loaded.append(data)
+        return self.result
+
+
+def test_blocks_are_loaded_in_submit_order():
+    loader = FakeLoader()
+    pipeline = ETLPipeline(FakeExtractor(), loader, queue_size=2)
+    pipeline.start()
+
+    for i in range(20):
+        pipeline.submit([i])
+    pipeline.join()
+
+    assert loader.loaded == [[i] for i in range(20)]
+
+
+def test_submit_blocks_while_queues_are_full():
+    loader = FakeLoader()
+    loader.release.clear()
+    pipeline = ETLPipeline(FakeExtractor(), loader, queue_size=1)
+    pipeline.start()
+    submitted = []
+
+    def submit_all() -> None:
+        for i in range(20):
+            pipeline.submit([i])
+            submitted.append(i)
+
+    producer = threading.Thread(target=submit_all, daemon=True)
+    producer.start()
+    time.sleep(0.3)
+
+    # Three bounded queues and three stages hold a few blocks at most
+    assert len(submitted) < 10
+    assert producer.is_alive()
+
+    loader.release.set()
+    producer.join(timeout=5)
+    pipeline.join()
+
+    assert len(loader.loaded) == 20
+
+
+def test_stage_error_is_raised_by_join():
+    loader = FakeLoader()
+    pipeline = ETLPipeline(FakeExtractor(fail_on=3), loader, queue_size=2)
+    pipeline.start()
+
+    for i in range(10):
+        try:
+            pipeline.submit([i])
+        except ValueError:
+            break
+
+    with pytest.raises(ValueError, match='transform failed'):
+        pipeline.join()
+
+    assert [3] not in loader.loaded
+    assert not any(worker.is_alive() for worker in pipeline.workers)
+
+
+def test_failed_load_raises_bulk_load_error():
+    pipeline = ETLPipeline(FakeExtractor(), FakeLoader(False), queue_size=2)
+    pipeline.start()
+    pipeline.submit([1])
+
+    with pytest.raises(BulkLoadError):
+        pipeline.join()
@@ -0,0 +1,21 @@
+from services.planner import ChangeSetPlanner
+
+
+def test_ids_are_deduplicated_in_insertion_order():
+    planner = ChangeSetPlanner(block_size=10)
+    planner.add(['c', 'a'])
+    planner.add(['b', 'a', 'c'])
+
+    assert len(planner) == 3
+    assert list(planner.blocks()) == [['c', 'a', 'b']]
+
+
+def test_ids_are_split_by_block_size():
+    planner = ChangeSetPlanner(block_size=2)
+    planner.add(['a', 'b', 'c', 'd', 'e'])
+
+    assert list(planner.blocks()) == [['a', 'b'], ['c', 'd'], ['e']]
+
+
+def test_empty_planner_has_no_blocks():
+    assert list(ChangeSetPlanner(block_size=2).blocks()) == []
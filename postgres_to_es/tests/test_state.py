@@ -0,0 +1,66 @@
+import pytest
+
+from state.state import (
+    InMemoryKeyValueClient,
+    JsonFileStorage,
+    KeyValueStorage,
+    State,
+    create_storage,
+)
+
+
+@pytest.fixture(params=['memory', 'json'])
+def make_storage(request, tmp_path):
+    """Create storages sharing one underlying state."""
+
+    client = InMemoryKeyValueClient()
+
+    def make() -> KeyValueStorage | JsonFileStorage:
+        if request.param == 'memory':
+            return KeyValueStorage(client)
+        return JsonFileStorage(str(tmp_path / 'state.json'))
+
+    return make
+
+
+def test_workers_do_not_overwrite_each_other(make_storage):
+    etl_state = State(make_storage())
+    reindex_state = State(make_storage())
+
+    # Both states are loaded before any of them is saved
+    assert etl_state.get_state('last_modified_person') is None
+    assert reindex_state.get_state('reindex_index') is None
+
+    with etl_state.transaction():
+        etl_state.set_state('last_modified_person', '2024-01-01')
+        etl_state.set_state('last_person_id', 'a')
+    reindex_state.set_state('reindex_index', 'movies_1')
+    etl_state.set_state('last_person_id', 'b')
+
+    assert State(make_storage()).data == {
+        'last_modified_person': '2024-01-01',
+        'last_person_id': 'b',
+        'reindex_index': 'movies_1',
+    }
+
+    assert etl_state.get_state('reindex_index') is None
+    etl_state.refresh()
+    assert etl_state.get_state('reindex_index') == 'movies_1'
+
+
+def test_failed_transaction_is_not_saved(make_storage):
+    state = State(make_storage())
+    state.set_state('last_person_id', 'a')
+
+    with pytest.raises(RuntimeError):
+        with state.transaction():
+            state.set_state('last_person_id', 'b')
+            raise RuntimeError
+
+    assert state.get_state('last_person_id') == 'a'
+    assert State(make_storage()).get_state('last_person_id') == 'a'
+
+
+def test_unknown_storage_is_rejected():
+    with pytest.raises(ValueError):
+        create_storage('sqlite')
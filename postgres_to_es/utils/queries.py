@@ -1,7 +1,8 @@
 get_modified_persons = """
     SELECT DISTINCT id, modified_at
     FROM content.person
-    WHERE (modified_at > %s OR (modified_at = %s AND id > %s))
+    WHERE (modified_at, id) > (%s, %s)
+        AND modified_at <= NOW() - MAKE_INTERVAL(secs => %s)
     ORDER BY modified_at, id
     LIMIT %s;
 """
@@ -9,7 +10,8 @@ get_modified_persons = """
 get_modified_genres = """
     SELECT DISTINCT id, modified_at
     FROM content.genre
-    WHERE (modified_at > %s OR (modified_at = %s AND id > %s))
+    WHERE (modified_at, id) > (%s, %s)
+        AND modified_at <= NOW() - MAKE_INTERVAL(secs => %s)
     ORDER BY modified_at, id
     LIMIT %s;
 """
@@ -17,11 +19,20 @@ get_modified_genres = """
 get_modified_filmworks = """
     SELECT DISTINCT id, modified_at
     FROM content.filmwork
-    WHERE (modified_at > %s OR (modified_at = %s AND id > %s))
+    WHERE (modified_at, id) > (%s, %s)
+        AND modified_at <= NOW() - MAKE_INTERVAL(secs => %s)
     ORDER BY modified_at, id
     LIMIT %s;
 """
 
+get_filmworks_in_range = """
+    SELECT id, modified_at
+    FROM content.filmwork
+    WHERE id > %s AND id <= %s
+    ORDER BY id
+    LIMIT %s;
+"""
+
 get_filmworks_by_modified_persons = """
     SELECT DISTINCT fw.id, fw.modified_at
     FROM content.filmwork fw
@@ -64,3 +75,94 @@ get_filmworks = """
     WHERE fw.id IN %s
     GROUP BY fw.id;
 """
+
+get_filmwork_documents = """
+    WITH filmworks AS (
+        SELECT id, title, description, rating
+        FROM content.filmwork
+        WHERE id = ANY(%(ids)s::uuid[])
+    ),
+    persons AS (
+        SELECT
+            pfw.filmwork_id,
+            MAX(p.full_name) FILTER (
+                WHERE pfw.role = 'director'
+            ) AS director,
+            ARRAY_AGG(p.full_name) FILTER (
+                WHERE pfw.role = 'actor'
+            ) AS actors_names,
+            ARRAY_AGG(p.full_name) FILTER (
+                WHERE pfw.role = 'writer'
+            ) AS writers_names,
+            JSON_AGG(
+                json_build_object('id', p.id, 'full_name', p.full_name)
+            ) FILTER (WHERE pfw.role = 'actor') AS actors,
+            JSON_AGG(
+                json_build_object('id', p.id, 'full_name', p.full_name)
+            ) FILTER (WHERE pfw.role = 'writer') AS writers
+        FROM content.person_filmwork pfw
+        JOIN content.person p ON p.id = pfw.person_id
+        WHERE pfw.filmwork_id = ANY(%(ids)s::uuid[])
+        GROUP BY pfw.filmwork_id
+    ),
+    genres AS (
+        SELECT gfw.filmwork_id, ARRAY_AGG(g.name) AS genre
+        FROM content.genre_filmwork gfw
+        JOIN content.genre g ON g.id = gfw.genre_id
+        WHERE gfw.filmwork_id = ANY(%(ids)s::uuid[])
+        GROUP BY gfw.filmwork_id
+    )
+    SELECT
+        fw.id,
+        fw.rating AS imdb_rating,
+        COALESCE(g.genre, '{}') AS genre,
+        fw.title,
+        fw.description,
+        COALESCE(p.director, '') AS director,
+        COALESCE(p.actors_names, '{}') AS actors_names,
+        COALESCE(p.writers_names, '{}') AS writers_names,
+        COALESCE(p.actors, '[]') AS actors,
+        COALESCE(p.writers, '[]') AS writers
+    FROM filmworks fw
+    LEFT JOIN persons p ON p.filmwork_id = fw.id
+    LEFT JOIN genres g ON g.filmwork_id = fw.id;
+"""
+
+get_person_links = """
+    SELECT p.id, p.full_name, pfw.filmwork_id, pfw.role
+    FROM content.person p
+    LEFT JOIN content.person_filmwork pfw ON pfw.person_id = p.id
+    WHERE p.id = ANY(%s::uuid[]);
+"""
+
+get_filmwork_genres = """
+    SELECT gfw.filmwork_id AS id, ARRAY_AGG(g.name) AS genre
+    FROM content.genre_filmwork gfw
+    JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE gfw.filmwork_id = ANY(%s::uuid[])
+    GROUP BY gfw.filmwork_id;
+"""
+
+create_migrations_table = """
+    CREATE TABLE IF NOT EXISTS content.etl_migrations (
+        version TEXT PRIMARY KEY,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    );
+"""
+
+lock_migrations = """
+    SELECT pg_advisory_xact_lock(hashtext('content.etl_migrations'));
+"""
+
+count_change_triggers = """
+    SELECT COUNT(*) FROM pg_trigger
+    WHERE NOT tgisinternal AND tgname = ANY(%s);
+"""
+
+get_applied_migrations = """
+    SELECT version FROM content.etl_migrations;
+"""
+
+insert_migration = """
+    INSERT INTO content.etl_migrations (version) VALUES (%s);
+"""
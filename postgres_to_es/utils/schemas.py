@@ -1,7 +1,8 @@
 from uuid import UUID
 from datetime import datetime
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import TypedDict
 
 
 class PGObject(BaseModel):
@@ -25,3 +26,25 @@ class ESFilmwork(BaseModel):
     writers_names: list
     actors: list[Person]
     writers: list[Person]
+
+
+class ESPersonDocument(TypedDict):
+    id: str
+    name: str
+
+
+class ESFilmworkDocument(TypedDict):
+    id: UUID
+    imdb_rating: float | None
+    genre: list[str]
+    title: str
+    description: str | None
+    director: str | None
+    actors_names: list[str]
+    writers_names: list[str]
+    actors: list[ESPersonDocument]
+    writers: list[ESPersonDocument]
+
+
+# Validates a whole batch of ES-ready documents at once
+es_filmwork_documents = TypeAdapter(list[ESFilmworkDocument])
@@ -0,0 +1,112 @@
+import datetime
+import re
+import struct
+import uuid
+from dataclasses import fields
+from typing import Any, Callable, Iterable, Iterator
+
+# Header of COPY binary format: signature, flags and extension length
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+
+TRAILER = struct.pack('!h', -1)
+
+NULL = struct.pack('!i', -1)
+
+PG_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+PG_EPOCH_DATE = PG_EPOCH.date()
+
+# SQLite stores offsets like +00, Python 3.10 expects +00:00
+SHORT_OFFSET = re.compile(r'([+-]\d{2})$')
+
+
+def parse_datetime(value: Any) -> datetime.datetime:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(
+            SHORT_OFFSET.sub(r'\1:00', value.strip())
+        )
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def parse_date(value: Any) -> datetime.date:
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def encode_uuid(value: Any) -> bytes:
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(value)
+    return value.bytes
+
+
+def encode_timestamptz(value: Any) -> bytes:
+    delta = parse_datetime(value) - PG_EPOCH
+    return struct.pack('!q', delta // datetime.timedelta(microseconds=1))
+
+
+def encode_date(value: Any) -> bytes:
+    return struct.pack('!i', (parse_date(value) - PG_EPOCH_DATE).days)
+
+
+def encode_float8(value: Any) -> bytes:
+    return struct.pack('!d', float(value))
+
+
+def encode_text(value: Any) -> bytes:
+    return str(value).encode('utf-8')
+
+
+ENCODERS = {
+    uuid.UUID: encode_uuid,
+    uuid.uuid4: encode_uuid,
+    datetime.datetime: encode_timestamptz,
+    datetime.date: encode_date,
+    float: encode_float8,
+    str: encode_text,
+}
+
+
+class BinaryCopyEncoder:
+    """Encode rows into Postgres COPY binary format.
+
+    Field types are taken from annotations of the table dataclass. Rows
+    are either its instances or tuples of values in the field order.
+    """
+
+    def __init__(self, schema: type) -> None:
+        schema_fields = fields(schema)
+        self.field_names = [field.name for field in schema_fields]
+        self.encoders: list[Callable[[Any], bytes]] = [
+            ENCODERS[field.type] for field in schema_fields
+        ]
+        self.field_count = struct.pack('!h', len(schema_fields))
+
+    def encode_row(self, values: Iterable) -> bytes:
+        parts = [self.field_count]
+        for encoder, value in zip(self.encoders, values):
+            if value is None:
+                parts.append(NULL)
+                continue
+            data = encoder(value)
+            parts.append(struct.pack('!i', len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    def encode(self, blocks: Iterable[list]) -> Iterator[bytes]:
+        """Yield COPY data: header, one chunk per block and trailer."""
+
+        yield HEADER
+        for block in blocks:
+            yield b''.join(
+                self.encode_row(
+                    item if isinstance(item, tuple) else
+                    [getattr(item, name) for name in self.field_names]
+                )
+                for item in block
+            )
+        yield TRAILER
@@ -1,5 +1,7 @@
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator
 
 from dotenv import load_dotenv
 from postgres_saver import PostgresSaver
@@ -22,6 +24,17 @@ logging.basicConfig(
 
 BLOCK_SIZE = 1000
 
+SQLITE_PATH = 'db.sqlite'
+
+# Параллельная загрузка включается при количестве процессов больше одного
+MIGRATION_WORKERS = int(os.environ.get('MIGRATION_WORKERS', 1))
+
+# Большие таблицы делятся на диапазоны rowid такого размера
+PARTITION_ROWS = int(os.environ.get('MIGRATION_PARTITION_ROWS', 100_000))
+
+# Строки диапазона загружаются и фиксируются блоками такого размера
+CHECKPOINT_ROWS = int(os.environ.get('MIGRATION_CHECKPOINT_ROWS', 10_000))
+
 TABLES = {
     'film_work': Filmwork,
     'person': Person,
@@ -30,6 +43,12 @@ TABLES = {
     'person_film_work': PersonFilmwork,
 }
 
+# Таблицы связей загружаются после таблиц, на которые они ссылаются
+TABLE_STAGES = [
+    ['film_work', 'person', 'genre'],
+    ['genre_film_work', 'person_film_work'],
+]
+
 DSN = {
     'dbname': os.environ.get('POSTGRES_DB'),
     'user': os.environ.get('POSTGRES_USER'),
@@ -43,34 +62,139 @@ DSN = {
 def load_from_sqlite():
     """Основной метод загрузки данных из SQLite в Postgres"""
 
-    sqlite_extractor = SQLiteExtractor('db.sqlite', BLOCK_SIZE)
-    postgres_saver = PostgresSaver(DSN, list(TABLES.keys()))
-
-    for table_name, schema_name in TABLES.items():
-        DATA_COUNT = 0
-        data = sqlite_extractor.extract_data(table_name, schema_name)
+    sqlite_extractor = SQLiteExtractor(SQLITE_PATH, BLOCK_SIZE)
+    postgres_saver = PostgresSaver(DSN)
+    postgres_saver.create_checkpoint_table()
 
+    for table_name in TABLES:
         try:
-            for block in data:
-                message = 'Получение данных из таблицы %s'
-                logging.info(message, table_name)
+            partitions = sqlite_extractor.get_rowid_ranges(
+                table_name,
+                PARTITION_ROWS,
+            )
+            for start_rowid, end_rowid in partitions:
+                load_rowid_range(
+                    sqlite_extractor,
+                    postgres_saver,
+                    table_name,
+                    start_rowid,
+                    end_rowid,
+                )
+        except Exception as exc:
+            message = 'Ошибка при загрузке данных в таблицу %s: %s'
+            logging.warning(message, table_name, exc)
+
+    postgres_saver.close()
+
+
+def load_from_sqlite_parallel(workers: int):
+    """Параллельная загрузка таблиц и диапазонов rowid в пуле процессов"""
+
+    sqlite_extractor = SQLiteExtractor(SQLITE_PATH, BLOCK_SIZE)
+    postgres_saver = PostgresSaver(DSN)
+    postgres_saver.create_checkpoint_table()
+    postgres_saver.close()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for stage in TABLE_STAGES:
+            futures = {}
+            for table_name in stage:
+                partitions = sqlite_extractor.get_rowid_ranges(
+                    table_name,
+                    PARTITION_ROWS,
+                )
+                for start_rowid, end_rowid in partitions:
+                    future = executor.submit(
+                        load_partition,
+                        table_name,
+                        start_rowid,
+                        end_rowid,
+                    )
+                    futures[future] = (table_name, start_rowid, end_rowid)
+
+            for future in as_completed(futures):
                 try:
-                    DATA_COUNT += len(block)
-                    message = 'Загрузка данных в таблицу %s'
-                    logging.info(message, table_name)
-                    postgres_saver.save_data(table_name, block)
-                    message = 'Суммарно загружено %s записей'
-                    logging.info(message, DATA_COUNT)
+                    future.result()
                 except Exception as exc:
-                    message = 'Ошибка при загрузке данных в таблицу %s: %s'
-                    logging.warning(message, table_name, exc)
+                    message = (
+                        'Ошибка при загрузке строк %s-%s таблицы %s: %s'
+                    )
+                    table_name, start_rowid, end_rowid = futures[future]
+                    logging.warning(
+                        message, start_rowid, end_rowid, table_name, exc
+                    )
 
-        except Exception as exc:
-            message = 'Ошибка при получении данных из таблицы %s: %s'
-            logging.warning(message, table_name, exc)
+
+def load_partition(table_name: str, start_rowid: int, end_rowid: int):
+    """Загрузка диапазона строк таблицы в отдельном процессе"""
+
+    sqlite_extractor = SQLiteExtractor(SQLITE_PATH, BLOCK_SIZE)
+    postgres_saver = PostgresSaver(DSN)
+
+    try:
+        load_rowid_range(
+            sqlite_extractor,
+            postgres_saver,
+            table_name,
+            start_rowid,
+            end_rowid,
+        )
+    finally:
+        postgres_saver.close()
+
+
+def load_rowid_range(
+    sqlite_extractor: SQLiteExtractor,
+    postgres_saver: PostgresSaver,
+    table_name: str,
+    start_rowid: int,
+    end_rowid: int,
+):
+    """Загрузка диапазона строк блоками, продолжая с контрольной точки"""
+
+    schema_name = TABLES[table_name]
+    last_rowid = postgres_saver.get_checkpoint(table_name, start_rowid)
+    if last_rowid is not None:
+        message = 'Продолжение загрузки таблицы %s со строки %s'
+        logging.info(message, table_name, last_rowid + 1)
+    else:
+        last_rowid = start_rowid - 1
+
+    message = 'Загрузка строк %s-%s в таблицу %s'
+    logging.info(message, last_rowid + 1, end_rowid, table_name)
+
+    for block_start in range(last_rowid + 1, end_rowid + 1, CHECKPOINT_ROWS):
+        block_end = min(block_start + CHECKPOINT_ROWS - 1, end_rowid)
+        data = sqlite_extractor.extract_rows(
+            table_name,
+            schema_name,
+            block_start,
+            block_end,
+        )
+        postgres_saver.save_block(
+            table_name,
+            schema_name,
+            count_blocks(data),
+            start_rowid,
+            block_end,
+        )
+
+
+def count_blocks(data: Iterable[list]) -> Iterator[list]:
+    """Пропускает блоки данных, записывая в лог количество записей"""
+
+    data_count = 0
+    for block in data:
+        data_count += len(block)
+        message = 'Суммарно передано %s записей'
+        logging.info(message, data_count)
+        yield block
 
 
 if __name__ == '__main__':
     logging.info('Начало выполнения ETL процесса')
-    load_from_sqlite()
+    if MIGRATION_WORKERS > 1:
+        load_from_sqlite_parallel(MIGRATION_WORKERS)
+    else:
+        load_from_sqlite()
     logging.info('Завершение ETL процесса')
@@ -1,59 +1,180 @@
 import io
+from contextlib import contextmanager
+from typing import Iterable, Iterator
 
 import psycopg2
 from psycopg2.extras import DictCursor
 
+from binary_copy import BinaryCopyEncoder
+
+
+# Tables with unique indexes on natural keys besides the primary key
+LINK_TABLES = ('genre_filmwork', 'person_filmwork')
+
+
+class IteratorFile(io.RawIOBase):
+    """Read-only file-like object over an iterator of bytes chunks.
+
+    Lets COPY pull rows from a generator, so the whole table is never
+    held in memory. Unread rest of a chunk is a view into it, so every
+    byte is copied once however small the reads are.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self.chunks = chunks
+        self.chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            data = b''.join([self.chunk, *self.chunks])
+            self.chunk = memoryview(b'')
+            return data
+
+        parts = []
+        while size > 0:
+            if not self.chunk:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.chunk = memoryview(chunk)
+            part = self.chunk[:size]
+            self.chunk = self.chunk[len(part):]
+            size -= len(part)
+            parts.append(part)
+
+        return b''.join(parts)
+
 
 class PostgresSaver:
 
-    def __init__(self, dsn: dict, tables: list[str]) -> None:
+    def __init__(self, dsn: dict) -> None:
         self.dsn = dsn
-        self.tables = tables
-        self.truncate_tables()
-
-    def truncate_tables(self) -> None:
-        for table_name in self.tables:
-            table_name = self.prepare_table_name(table_name)
-
-    def execute_query(self, query: str, data=None, is_copy=False) -> None:
-        with psycopg2.connect(**self.dsn, cursor_factory=DictCursor) as conn:
-            cursor = conn.cursor()
-            if is_copy:
-                cursor.copy_expert(query, data)
-            else:
-                cursor.execute(query)
-            cursor.close()
+        self.conn = None
+
+    def create_checkpoint_table(self) -> None:
+        """Create table of last loaded rowids of each table partition."""
+
+        query = """
+            CREATE TABLE IF NOT EXISTS content.migration_checkpoint (
+                table_name TEXT NOT NULL,
+                partition_start BIGINT NOT NULL,
+                last_rowid BIGINT NOT NULL,
+                modified_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                PRIMARY KEY (table_name, partition_start)
+            )
+        """
+        with self.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(query)
+
+    @contextmanager
+    def connect(self) -> psycopg2.extensions.connection:
+        """Reuse one connection, commit on success and rollback on error."""
+
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(**self.dsn, cursor_factory=DictCursor)
+        with self.conn:
+            yield self.conn
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
     def prepare_table_name(self, table_name: str) -> str:
         if 'film_work' in table_name:
             table_name = table_name.replace('film_work', 'filmwork')
         return table_name
 
-    def generate_csv_obj(self, data: list) -> io.StringIO:
-        csv_data = io.StringIO()
+    def prepare_column_name(self, column_name: str) -> str:
+        return self.prepare_table_name(column_name)
 
-        for item in data:
-            values = list(item._asdict.values())
-            parsed_values = [str((lambda i: i or '')(i)) for i in values]
-            final_string = '|'.join(parsed_values) + '\n'
-            csv_data.write(final_string)
-        csv_data.seek(0)
+    def get_checkpoint(
+        self, table_name: str, partition_start: int
+    ) -> int | None:
+        """Return last loaded rowid of a table partition."""
 
-        return csv_data
+        query = """
+            SELECT last_rowid FROM content.migration_checkpoint
+            WHERE table_name = %s AND partition_start = %s
+        """
+        with self.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(query, (table_name, partition_start))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def save_block(
+        self,
+        table_name: str,
+        schema: type,
+        blocks: Iterable[list],
+        partition_start: int,
+        last_rowid: int,
+    ) -> None:
+        """Upsert rows of a block and save checkpoint in one transaction.
 
-    def save_data(self, table_name: str, data: list) -> None:
-        """Load data to Postgres tables."""
+        Rows are streamed with binary COPY into a staging table and merged
+        into the target one, so blocks loaded before are updated instead
+        of failing on duplicate keys. Rows modified in Postgres after the
+        SQLite copy are kept, so a rerun never reverts them. Link tables
+        are also unique by their natural keys, rows already linked under
+        other ids are skipped.
+        """
 
+        encoder = BinaryCopyEncoder(schema)
+        checkpoint_name = table_name
         table_name = self.prepare_table_name(table_name)
-        csv_data = self.generate_csv_obj(data)
-        query = f"""
-            COPY content.{table_name}
-            FROM STDIN (
-                FORMAT 'csv',
-                HEADER false,
-                DELIMITER '|',
-                ENCODING 'UTF8',
-                QUOTE E'\u0007'
+        staging_name = f'staging_{table_name}'
+        column_names = [
+            self.prepare_column_name(name) for name in encoder.field_names
+        ]
+        columns = ', '.join(column_names)
+        if table_name in LINK_TABLES:
+            conflict_action = 'ON CONFLICT DO NOTHING'
+        else:
+            updates = ', '.join(
+                f'{name} = EXCLUDED.{name}'
+                for name in column_names if name != 'id'
             )
+            target = f'content.{table_name}'
+            conflict_action = f"""
+                ON CONFLICT (id) DO UPDATE SET {updates}
+                WHERE {target}.modified_at IS NULL
+                    OR {target}.modified_at < EXCLUDED.modified_at
+            """
+
+        # Temporary tables are not WAL-logged and private to the session,
+        # so partitions loaded in parallel never share staging rows
+        create_query = f"""
+            CREATE TEMPORARY TABLE IF NOT EXISTS {staging_name}
+            (LIKE content.{table_name})
+            ON COMMIT DELETE ROWS
+        """
+        copy_query = f"""
+            COPY {staging_name} ({columns})
+            FROM STDIN (FORMAT binary)
+        """
+        merge_query = f"""
+            INSERT INTO content.{table_name} ({columns})
+            SELECT {columns} FROM {staging_name}
+            {conflict_action}
         """
-        self.execute_query(query, csv_data, True)
+        checkpoint_query = """
+            INSERT INTO content.migration_checkpoint
+                (table_name, partition_start, last_rowid)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (table_name, partition_start) DO UPDATE
+            SET last_rowid = EXCLUDED.last_rowid, modified_at = NOW()
+        """
+
+        copy_data = IteratorFile(encoder.encode(blocks))
+        with self.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(create_query)
+            cursor.copy_expert(copy_query, copy_data)
+            cursor.execute(merge_query)
+            cursor.execute(
+                checkpoint_query,
+                (checkpoint_name, partition_start, last_rowid),
+            )
@@ -1,5 +1,12 @@
 import sqlite3
 from contextlib import contextmanager
+from dataclasses import fields
+from typing import Iterator
+
+# SQLite columns selected under names of dataclass fields
+SQLITE_COLUMNS = {
+    'modified_at': 'updated_at AS modified_at',
+}
 
 
 class SQLiteExtractor:
@@ -9,39 +16,75 @@ class SQLiteExtractor:
 
     @contextmanager
     def connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.dp_path)
-        conn.row_factory = sqlite3.Row
+        # Read-only connections let several processes read the file at once
+        conn = sqlite3.connect(f'file:{self.dp_path}?mode=ro', uri=True)
         try:
             yield conn
         finally:
             conn.close()
 
-    def prepare_data(self, obj: dict) -> dict:
-        try:
-            obj['modified_at'] = obj.pop('updated_at')
-            del obj['file_path']
-        finally:
-            return obj
+    def get_rowid_ranges(
+        self, table_name: str, partition_size: int
+    ) -> list[tuple[int, int]]:
+        """Split table into inclusive rowid ranges of partition_size."""
+
+        query = f"""SELECT MIN(rowid), MAX(rowid) FROM {table_name}"""
+
+        with self.connect() as conn:
+            min_rowid, max_rowid = conn.execute(query).fetchone()
 
-    def extract_data(self, table_name: str, schema: type) -> list:
-        """Extract data from SQLite and return list of dataclasses."""
+        if min_rowid is None:
+            return []
 
-        query = f"""SELECT * FROM {table_name}"""
+        return [
+            (start, min(start + partition_size - 1, max_rowid))
+            for start in range(min_rowid, max_rowid + 1, partition_size)
+        ]
+
+    def _fetch_blocks(
+        self,
+        query: str,
+        start_rowid: int | None,
+        end_rowid: int | None,
+    ) -> Iterator[list[tuple]]:
+        """Execute query and yield its rows by blocks.
+
+        With rowid bounds only rows of the inclusive range are extracted.
+        """
+
+        params = ()
+        if start_rowid is not None:
+            query += ' WHERE rowid BETWEEN ? AND ?'
+            params = (start_rowid, end_rowid)
 
         with self.connect() as conn:
             cursor = conn.cursor()
-            cursor.execute(query)
+            cursor.execute(query, params)
 
             while True:
                 data = cursor.fetchmany(self.block_size)
                 if not data:
                     cursor.close()
                     break
+                yield data
+
+    def extract_rows(
+        self,
+        table_name: str,
+        schema: type,
+        start_rowid: int | None = None,
+        end_rowid: int | None = None,
+    ) -> Iterator[list[tuple]]:
+        """Extract data from SQLite as plain tuples.
+
+        Values are ordered as fields of the schema dataclass, columns are
+        renamed and unused ones are dropped by the query itself.
+        """
 
-                parsed_data = []
-                for item in data:
-                    item = self.prepare_data(dict(item))
-                    obj = schema(**item)
-                    parsed_data.append(obj)
+        columns = ', '.join(
+            SQLITE_COLUMNS.get(field.name, field.name)
+            for field in fields(schema)
+        )
+        query = f"""SELECT {columns} FROM {table_name}"""
 
-                yield parsed_data
+        yield from self._fetch_blocks(query, start_rowid, end_rowid)
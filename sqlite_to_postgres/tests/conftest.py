@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules of the migration are imported relative to its directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,83 @@
+import datetime
+import struct
+import uuid
+
+from binary_copy import HEADER, NULL, TRAILER, BinaryCopyEncoder
+from etl_dataclasses import Filmwork
+
+FILMWORK_ID = uuid.UUID('3d825f60-9fff-4dfe-b294-1a45fa1e115d')
+
+ROW = (
+    '2021-06-16 20:14:09.221855+00',
+    '2021-06-16 20:14:09.221855+00',
+    str(FILMWORK_ID),
+    'Star Wars',
+    None,
+    '1977-05-25',
+    0.0,
+    '',
+)
+
+
+def decode_fields(row: bytes) -> list:
+    """Split encoded row into field values, None for NULL."""
+
+    count, = struct.unpack('!h', row[:2])
+    offset = 2
+    values = []
+    for _ in range(count):
+        length, = struct.unpack('!i', row[offset:offset + 4])
+        offset += 4
+        if length == -1:
+            values.append(None)
+            continue
+        values.append(row[offset:offset + length])
+        offset += length
+    assert offset == len(row)
+    return values
+
+
+def test_encode_wraps_blocks_with_header_and_trailer():
+    encoder = BinaryCopyEncoder(Filmwork)
+
+    chunks = list(encoder.encode([[ROW], [ROW, ROW]]))
+
+    assert chunks[0] == HEADER
+    assert chunks[-1] == TRAILER
+    assert chunks[1] == encoder.encode_row(ROW)
+    assert chunks[2] == encoder.encode_row(ROW) * 2
+
+
+def test_encode_row_fields():
+    row = BinaryCopyEncoder(Filmwork).encode_row(ROW)
+    created_at, modified_at, fw_id, title, description, creation_date, \
+        rating, fw_type = decode_fields(row)
+
+    expected_at = datetime.datetime(
+        2021, 6, 16, 20, 14, 9, 221855, tzinfo=datetime.timezone.utc
+    )
+    epoch = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    microseconds = (expected_at - epoch) // datetime.timedelta(microseconds=1)
+    assert created_at == modified_at == struct.pack('!q', microseconds)
+    assert fw_id == FILMWORK_ID.bytes
+    assert title == 'Star Wars'.encode('utf-8')
+    assert description is None
+    days = (datetime.date(1977, 5, 25) - datetime.date(2000, 1, 1)).days
+    assert creation_date == struct.pack('!i', days)
+    # Falsy values are not NULL
+    assert rating == struct.pack('!d', 0.0)
+    assert fw_type == b''
+
+
+def test_null_is_encoded_as_negative_length():
+    row = BinaryCopyEncoder(Filmwork).encode_row(ROW)
+
+    assert NULL in row
+    assert decode_fields(row)[4] is None
+
+
+def test_dataclass_rows_are_encoded_as_tuples():
+    encoder = BinaryCopyEncoder(Filmwork)
+    filmwork = Filmwork(*ROW)
+
+    assert list(encoder.encode([[filmwork]])) == list(encoder.encode([[ROW]]))
@@ -0,0 +1,123 @@
+import pytest
+
+import postgres_saver
+from etl_dataclasses import Filmwork, GenreFilmwork
+from postgres_saver import IteratorFile, PostgresSaver
+
+
+class FakeConnection:
+
+    def __init__(self) -> None:
+        self.closed = 0
+        self.commits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.commits += 1
+
+    def close(self) -> None:
+        self.closed = 1
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+
+    def __init__(self, connection: FakeConnection) -> None:
+        self.connection = connection
+        connection.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, query: str, params=None) -> None:
+        self.connection.queries.append(' '.join(query.split()))
+
+    def copy_expert(self, query: str, file) -> None:
+        self.connection.copied = file.read()
+
+
+@pytest.mark.parametrize('size', [1, 3, 8192])
+def test_iterator_file_reads_every_chunk(size):
+    chunks = [b'PGCOPY', b'', b'row-1', b'row-22', b'\xff\xff']
+    file = IteratorFile(iter(chunks))
+
+    data = b''
+    # COPY reads the file by blocks of the given size
+    while block := file.read(size):
+        assert len(block) <= size
+        data += block
+
+    assert data == b''.join(chunks)
+
+
+def test_iterator_file_reads_all():
+    file = IteratorFile(iter([b'ab', b'cd']))
+
+    assert file.read(1) == b'a'
+    assert file.read() == b'bcd'
+    assert file.read(1) == b''
+
+
+def test_saver_reuses_connection(monkeypatch):
+    connections = []
+
+    def connect(**kwargs) -> FakeConnection:
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(postgres_saver.psycopg2, 'connect', connect)
+    saver = PostgresSaver({})
+
+    for _ in range(3):
+        with saver.connect():
+            pass
+
+    assert len(connections) == 1
+    assert connections[0].commits == 3
+
+    saver.close()
+    with saver.connect():
+        pass
+
+    assert connections[0].closed
+    assert len(connections) == 2
+
+
+@pytest.fixture
+def saver(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(
+        postgres_saver.psycopg2, 'connect', lambda **kwargs: connection
+    )
+    return PostgresSaver({})
+
+
+def test_merge_keeps_rows_modified_in_postgres(saver):
+    saver.save_block('film_work', Filmwork, [[]], 0, 10)
+
+    merge_query = saver.conn.queries[1]
+    assert merge_query.startswith('INSERT INTO content.filmwork')
+    assert merge_query.endswith(
+        'WHERE content.filmwork.modified_at IS NULL '
+        'OR content.filmwork.modified_at < EXCLUDED.modified_at'
+    )
+    assert saver.conn.queries[2].startswith(
+        'INSERT INTO content.migration_checkpoint'
+    )
+
+
+def test_merge_skips_existing_links(saver):
+    saver.save_block('genre_film_work', GenreFilmwork, [[]], 0, 10)
+
+    assert saver.conn.queries[1].startswith(
+        'INSERT INTO content.genre_filmwork'
+    )
+    assert saver.conn.queries[1].endswith('ON CONFLICT DO NOTHING')
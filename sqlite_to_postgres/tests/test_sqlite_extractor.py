@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+from etl_dataclasses import Filmwork
+from sqlite_extractor import SQLiteExtractor
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE film_work (
+            id TEXT PRIMARY KEY,
+            title TEXT,
+            description TEXT,
+            creation_date DATE,
+            file_path TEXT,
+            rating FLOAT,
+            type TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    """)
+    conn.executemany(
+        'INSERT INTO film_work VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [
+            (
+                f'id-{i}', f'title-{i}', None, '2000-01-01', 'path',
+                float(i), 'movie', f'created-{i}', f'updated-{i}',
+            )
+            for i in range(5)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_rows_follow_schema_fields(db_path):
+    extractor = SQLiteExtractor(db_path, block_size=10)
+
+    rows = [row for block in extractor.extract_rows('film_work', Filmwork)
+            for row in block]
+
+    assert rows[0] == (
+        'created-0', 'updated-0', 'id-0', 'title-0', None,
+        '2000-01-01', 0.0, 'movie',
+    )
+    assert len(rows) == 5
+
+
+def test_rows_of_rowid_range_by_blocks(db_path):
+    extractor = SQLiteExtractor(db_path, block_size=2)
+
+    blocks = list(extractor.extract_rows('film_work', Filmwork, 2, 4))
+
+    assert [[row[2] for row in block] for block in blocks] == [
+        ['id-1', 'id-2'], ['id-3'],
+    ]
+    assert extractor.get_rowid_ranges('film_work', 2) == [
+        (1, 2), (3, 4), (5, 5),
+    ]